@@ -1,24 +1,35 @@
-from fastapi import FastAPI, HTTPException, Request
-from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Depends
+from contextlib import asynccontextmanager, contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import Iterator, Optional
+from watchdog.observers import Observer
 from watchdog.observers.polling import PollingObserver
 from watchdog.events import FileSystemEventHandler
+import anyio
+import collections
+import enum
+import itertools
 import json
+import orjson
 import os
+import queue
 import subprocess
 import threading
 import time
 import uuid
-from datetime import datetime, timezone
+from types import MappingProxyType
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 import sqlite3
 import glob
 import re
 import shutil
+import stat
+import struct
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -41,8 +52,19 @@ async def lifespan(app: FastAPI):
             obs.join()
         except:
             pass
+    _watch_executor.shutdown(wait=False, cancel_futures=True)
+    _db_maintenance_stop.set()
+    _db_pool.close_all()
+    if _db_writer_conn is not None:
+        try:
+            _db_writer_conn.execute("PRAGMA optimize")
+        except sqlite3.Error:
+            pass
+        _db_writer_conn.close()
 
-app = FastAPI(title="Shrync", version=SHRYNC_VERSION, lifespan=lifespan)
+# orjson (C-extensie) serialiseert alle JSON-antwoorden i.p.v. de stdlib json
+app = FastAPI(title="Shrync", version=SHRYNC_VERSION, lifespan=lifespan,
+              default_response_class=ORJSONResponse)
 
 BASE_DIR = Path(__file__).parent.parent
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
@@ -52,11 +74,175 @@ DB_PATH = "/config/shrync.db"
 os.makedirs("/config", exist_ok=True)
 
 # ── Database ──────────────────────────────────────────────────────────────────
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+# Eén proces-brede pool van langlevende verbindingen in WAL-modus. Elke
+# get_db() hergebruikt een open verbinding (warme page cache, geen open() op
+# db/-wal/-shm per query). conn.close() geeft de verbinding terug aan de pool.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))  # vrije verbindingen in de pool
+
+def _open_db_connection() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")      # 64 MB page cache
+    conn.execute("PRAGMA mmap_size=268435456")    # 256 MB memory-mapped I/O
+    conn.execute("PRAGMA wal_autocheckpoint=1000")  # checkpoint na ~1000 WAL-pagina's
+    # Planner-statistieken bijwerken waar nodig (0x10002: ook tabellen die nog
+    # nooit geanalyseerd zijn, met een beperkte analyse zodat het snel blijft)
+    conn.execute("PRAGMA optimize=0x10002")
     return conn
 
+class PooledConnection:
+    """
+    Dunne wrapper rond een sqlite3.Connection uit de pool.
+    close() sluit de verbinding niet maar geeft hem terug; een niet-gecommitte
+    transactie wordt daarbij teruggedraaid zodat de volgende gebruiker schoon begint.
+    """
+    __slots__ = ("_conn", "_pool")
+
+    def __init__(self, conn: sqlite3.Connection, pool: "ConnectionPool"):
+        self._conn = conn
+        self._pool = pool
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError("Verbinding is al teruggegeven aan de pool")
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn)
+
+class ConnectionPool:
+    """
+    Queue-gebaseerde pool: maximaal `size` vrije verbindingen blijven open.
+    Bij een lege pool wordt een extra verbinding geopend (nooit blokkeren —
+    sommige threads houden kort twee verbindingen vast); extra verbindingen
+    die terugkomen terwijl de pool vol is worden gesloten.
+    """
+    def __init__(self, size: int):
+        self._idle = queue.Queue(maxsize=size)
+
+    def acquire(self) -> PooledConnection:
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = _open_db_connection()
+        return PooledConnection(conn, self)
+
+    def release(self, conn: sqlite3.Connection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                conn.execute("PRAGMA optimize")  # aanbevolen vlak voor het sluiten
+            except sqlite3.Error:
+                pass
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+_db_pool = ConnectionPool(DB_POOL_SIZE)
+
+def get_db() -> PooledConnection:
+    return _db_pool.acquire()
+
+# SQLite staat één schrijver tegelijk toe: schrijvende API-endpoints delen één
+# vaste verbinding en wachten op elkaar via een semaphore in plaats van
+# tegen elkaar aan te lopen op de database-lock.
+_db_writer_conn = None
+_db_writer_sem = threading.Semaphore(1)
+
+@contextmanager
+def db_writer_session() -> Iterator[sqlite3.Connection]:
+    """
+    Leent de gedeelde schrijfverbinding. Voor endpoints die eerst trage
+    ffprobe-aanroepen doen: pak de verbinding pas als er geschreven wordt.
+    """
+    global _db_writer_conn
+    with _db_writer_sem:
+        if _db_writer_conn is None:
+            _db_writer_conn = _open_db_connection()
+        conn = _db_writer_conn
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+
+def db_writer() -> Iterator[sqlite3.Connection]:
+    """FastAPI-dependency voor schrijvende endpoints: de gedeelde schrijfverbinding."""
+    with db_writer_session() as conn:
+        yield conn
+
+# Leesqueries van async endpoints draaien in een eigen, begrensde groep
+# threads (CPU's + 1) zodat ze de event loop en de algemene FastAPI-threadpool
+# niet bezet houden terwijl ze op SQLite wachten.
+_db_read_limiter = anyio.CapacityLimiter((os.cpu_count() or 1) + 1)
+
+def rows_as_dicts(conn, fields: tuple, sql: str, params=()) -> list:
+    """
+    Voert `sql` uit met een cursor zonder row factory (kale tuples, geen
+    sqlite3.Row per rij) en koppelt de kolommen aan `fields`. De SELECT moet
+    de kolommen in exact die volgorde opleveren.
+    """
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute(sql, params)
+    return [dict(zip(fields, r)) for r in cur.fetchall()]
+
+async def run_db_read(fn, *args):
+    """Roept fn(conn, *args) aan met een pool-verbinding, buiten de event loop."""
+    def call():
+        with get_db() as conn:
+            return fn(conn, *args)
+    return await anyio.to_thread.run_sync(call, limiter=_db_read_limiter)
+
+# Wachtrij-ids zijn tijd-geordend (UUID versie 7, RFC 9562): 48 bit
+# milliseconden, 12 bit teller binnen dezelfde milliseconde, 62 bit toeval.
+# Nieuwe rijen komen zo achteraan de primaire-sleutel-B-tree terecht i.p.v.
+# willekeurig verspreid zoals bij uuid4. Let op: de eerste tekens zijn de
+# tijdstempel — gebruik de laatste tekens als korte id in logs.
+_uuid7_lock = threading.Lock()
+_uuid7_last_ms = 0
+_uuid7_seq = 0
+
+def uuid7() -> str:
+    global _uuid7_last_ms, _uuid7_seq
+    with _uuid7_lock:
+        ms = time.time_ns() // 1_000_000
+        if ms > _uuid7_last_ms:
+            _uuid7_last_ms, _uuid7_seq = ms, 0
+        else:
+            # Zelfde (of teruggelopen) klok: teller ophogen, bij overloop de
+            # tijdstempel kunstmatig een milliseconde vooruit zetten
+            _uuid7_seq += 1
+            if _uuid7_seq > 0xFFF:
+                _uuid7_last_ms, _uuid7_seq = _uuid7_last_ms + 1, 0
+        ms, seq = _uuid7_last_ms, _uuid7_seq
+    rand = int.from_bytes(os.urandom(8), "big") & ((1 << 62) - 1)
+    value = (ms << 80) | (0x7 << 76) | (seq << 64) | (0b10 << 62) | rand
+    return str(uuid.UUID(int=value))
+
 def init_db():
     conn = get_db()
     c = conn.cursor()
@@ -110,6 +296,7 @@ def init_db():
     c.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('language', 'en')")
     c.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('conversion_profile', 'nvenc_max')")
     c.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('audio_codec', 'copy')")
+    c.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('watch_interval', '60')")
     c.execute("""CREATE TABLE IF NOT EXISTS history (
         id TEXT PRIMARY KEY,
         library_id TEXT,
@@ -121,6 +308,56 @@ def init_db():
         error_msg TEXT,
         finished_at TEXT DEFAULT CURRENT_TIMESTAMP
     )""")
+    # Eerder gevonden codecs per bestand; geldig zolang mtime (ns) en grootte
+    # overeenkomen — een volgende scan hoeft ongewijzigde bestanden niet te lezen
+    c.execute("""CREATE TABLE IF NOT EXISTS codec_cache (
+        path TEXT PRIMARY KEY,
+        mtime INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        codec TEXT NOT NULL
+    )""")
+
+    # ── Indexen voor de veelgebruikte queries ─────────────────────────────────
+    # dispatcher en /api/queue: WHERE status ... ORDER BY added_at, id (added_at
+    # heeft maar secondenresolutie; de tijd-geordende uuid7-id houdt rijen uit
+    # dezelfde seconde in invoegvolgorde). DESC zodat ook ORDER BY status DESC,
+    # added_at ASC, id ASC zonder sortering kan;
+    # scan/watcher/API: dedup op file_path + status; geschiedenis: finished_at;
+    # statistieken: status + finished_at
+    old_idx = c.execute("SELECT sql FROM sqlite_master WHERE type='index' "
+                        "AND name='idx_queue_status_added'").fetchone()
+    if old_idx and "id DESC" not in old_idx[0]:
+        c.execute("DROP INDEX idx_queue_status_added")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_queue_status_added ON queue(status, added_at DESC, id DESC)")
+    c.execute("DROP INDEX IF EXISTS idx_queue_filepath")  # vervangen door idx_queue_filepath_status
+    c.execute("CREATE INDEX IF NOT EXISTS idx_queue_filepath_status ON queue(file_path, status)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_history_finished ON history(finished_at DESC)")
+    # Een bestand mag maar één keer actief in de wachtrij staan — afgedwongen
+    # door SQLite zelf. Mislukt op een oude database met dubbele actieve
+    # items; dan blijft de controle in de code de enige bescherming.
+    try:
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_queue_active_path ON queue(file_path) "
+                  "WHERE status IN ('pending','processing')")
+    except sqlite3.IntegrityError as e:
+        logger.warning(f"Unieke wachtrij-index niet aangemaakt (dubbele items): {e}")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_history_filepath_status ON history(file_path, status)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_history_status_finished ON history(status, finished_at)")
+    # idx_history_status_finished dekt ook de besparingsstatistieken; de oude
+    # partiële index op dezelfde kolommen was overbodig
+    c.execute("DROP INDEX IF EXISTS idx_history_success")
+
+    # ── Tellers ───────────────────────────────────────────────────────────────
+    # Aantal geschiedenisregels, bijgehouden door triggers: /api/history hoeft
+    # dan niet bij elke pagina de hele tabel te tellen
+    c.execute("""CREATE TABLE IF NOT EXISTS meta (
+        k TEXT PRIMARY KEY,
+        v INTEGER NOT NULL
+    )""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS history_count_ai AFTER INSERT ON history
+        BEGIN UPDATE meta SET v = v + 1 WHERE k='history_count'; END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS history_count_ad AFTER DELETE ON history
+        BEGIN UPDATE meta SET v = v - 1 WHERE k='history_count'; END""")
+    c.execute("INSERT OR IGNORE INTO meta (k, v) SELECT 'history_count', COUNT(*) FROM history")
 
     # ── Ondertiteling tabellen ────────────────────────────────────────────────
     c.execute("""CREATE TABLE IF NOT EXISTS subtitle_queue (
@@ -170,10 +407,45 @@ def init_db():
     c.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('theme', 'dark')")
 
     conn.commit()
+    # Na (mogelijke) schemawijzigingen: statistieken voor de nieuwe indexen
+    c.execute("PRAGMA optimize")
     conn.close()
 
 init_db()
 
+# ── Database-onderhoud ────────────────────────────────────────────────────────
+# Elk uur de WAL terugzetten naar nul bytes (wal_autocheckpoint houdt hem
+# alleen begrensd zolang er geen lange lezers zijn), één keer per nacht een
+# volledige ANALYZE zodat de planner bij gegroeide tabellen de juiste index
+# blijft kiezen.
+DB_CHECKPOINT_INTERVAL = 3600
+DB_ANALYZE_HOUR        = 4  # lokale tijd
+
+_db_maintenance_stop = threading.Event()  # gezet bij afsluiten
+
+def _next_analyze_after(now: datetime) -> datetime:
+    """Eerstvolgende DB_ANALYZE_HOUR:00 (lokale tijd) na `now`."""
+    at = now.replace(hour=DB_ANALYZE_HOUR, minute=0, second=0, microsecond=0)
+    return at if at > now else at + timedelta(days=1)
+
+def db_maintenance_loop():
+    # ANALYZE zodra het geplande moment verstreken is, ook als de wekker door
+    # drift of een lange checkpoint net na het uur afgaat (inhalen, niet overslaan)
+    next_analyze = _next_analyze_after(datetime.now())
+    while not _db_maintenance_stop.wait(DB_CHECKPOINT_INTERVAL):
+        try:
+            with get_db() as conn:
+                busy, wal_pages, moved = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+                logger.debug(f"WAL checkpoint: busy={busy}, pagina's={wal_pages}, verplaatst={moved}")
+                now = datetime.now()
+                if now >= next_analyze:
+                    conn.execute("ANALYZE")
+                    conn.commit()
+                    next_analyze = _next_analyze_after(now)
+                    logger.info("Database: ANALYZE uitgevoerd")
+        except sqlite3.Error as e:
+            logger.warning(f"Database-onderhoud mislukt: {e}")
+
 # ── Cleanup stale conversions on startup ──────────────────────────────────────
 def cleanup_stale_conversions():
     """Ruim loshangende tijdelijke bestanden op en zet taken terug naar pending."""
@@ -232,14 +504,41 @@ cleanup_stale_subtitles()
 
 # ── State ─────────────────────────────────────────────────────────────────────
 active_jobs = {}        # slot_name -> {"id": job_id, "process": process}
+jid_to_slot = {}        # job_id -> zelfde slot-dict als in active_jobs (O(1) opzoeken)
 active_jobs_lock = threading.Lock()
 worker_threads = []
 worker_running = False
 workers_paused = False  # pauze flag: workers slaan taken over als True
-scan_status = {}        # library_id -> {status, scanned, added, skipped, already_converted, current_file, error}
+# library_id -> {status, scanned, added, skipped, already_converted, current_file, error}
+# Copy-on-write: de scanner publiceert telkens een nieuwe, onveranderlijke
+# snapshot (atomaire herbinding); lezers hebben geen lock nodig en zien nooit
+# een dict die tijdens het serialiseren van grootte verandert.
+scan_status = MappingProxyType({})
+_scan_status_lock = threading.Lock()  # alleen tussen schrijvers
+SCAN_STATUS_PUBLISH_INTERVAL = 0.5    # seconden tussen tussentijdse snapshots
 _observers = []
 _sub_dispatcher_running = False  # hier gedefinieerd zodat lifespan er zeker bij kan
 
+# ── Wachtrij-signalering ──────────────────────────────────────────────────────
+# Producenten (scan, watcher, API) en vrijkomende slots wekken de dispatcher
+# via deze condition — geen periodieke poll op een lege wachtrij.
+_queue_cv = threading.Condition()
+_queue_dirty = False
+
+def notify_queue():
+    """Meld de dispatcher dat er nieuw werk of een vrij slot is."""
+    global _queue_dirty
+    with _queue_cv:
+        _queue_dirty = True
+        _queue_cv.notify_all()
+
+def wait_for_queue(timeout: float):
+    """Wacht tot notify_queue() is aangeroepen of de timeout verstrijkt."""
+    global _queue_dirty
+    with _queue_cv:
+        _queue_cv.wait_for(lambda: _queue_dirty, timeout=timeout)
+        _queue_dirty = False
+
 # ── Models ────────────────────────────────────────────────────────────────────
 class LibraryCreate(BaseModel):
     name: str
@@ -251,14 +550,32 @@ class LibraryUpdate(LibraryCreate):
     enabled: Optional[bool] = True
 
 # ── Settings helper ───────────────────────────────────────────────────────────
+# Instellingen worden per sleutel 30 seconden in geheugen gehouden; de
+# settings-API leegt de cache bij elke wijziging.
+SETTINGS_CACHE_TTL = 30.0
+_settings_cache = {}    # key -> (value of None, verloopt_op)
+_settings_cache_lock = threading.Lock()
+
 def get_global_setting(key: str, default: str = '') -> str:
+    now = time.monotonic()
+    with _settings_cache_lock:
+        cached = _settings_cache.get(key)
+    if cached and cached[1] > now:
+        return cached[0] if cached[0] is not None else default
     try:
         conn = get_db()
         row = conn.execute("SELECT value FROM settings WHERE key=?", (key,)).fetchone()
         conn.close()
-        return row["value"] if row else default
     except:
         return default
+    value = row["value"] if row else None
+    with _settings_cache_lock:
+        _settings_cache[key] = (value, now + SETTINGS_CACHE_TTL)
+    return value if value is not None else default
+
+def invalidate_settings_cache():
+    with _settings_cache_lock:
+        _settings_cache.clear()
 
 def get_max_workers() -> int:
     try:
@@ -268,7 +585,10 @@ def get_max_workers() -> int:
         return 1
 
 # ── Helper: check if file needs conversion ────────────────────────────────────
-VIDEO_EXTENSIONS = {".mkv", ".mp4", ".avi", ".mov", ".m4v", ".ts", ".wmv", ".flv"}
+VIDEO_EXTENSIONS = frozenset({".mkv", ".mp4", ".avi", ".mov", ".m4v", ".ts", ".wmv", ".flv"})
+# Voor str.endswith (in C): eerst de naam zoals hij is, pas bij een miss
+# .lower() — de gebruikelijke kleine-letter-extensie kost dan geen nieuwe string
+_VIDEO_SUFFIX_TUPLE = tuple(VIDEO_EXTENSIONS)
 
 # ── Conversion profiles ───────────────────────────────────────────────────────
 # profile_id -> (video_codec, nvenc_preset_or_cpu_preset, cq_or_crf)
@@ -512,39 +832,328 @@ def build_cpu_cmd(src, tmp_out, codec, preset, crf, audio_codec, hdr: dict = Non
     return cmd
 
 
-def needs_conversion(file_path: str, target_codec: str) -> bool:
+# ── Snelle codec-detectie zonder ffprobe ──────────────────────────────────────
+# Voor MP4/MOV en MKV lezen we de codec direct uit de containerheaders; dat
+# scheelt per bestand een ffprobe-proces. Alleen overige containers (of een
+# header die we niet kunnen lezen) vallen terug op ffprobe.
+_MP4_EXTENSIONS = frozenset({".mp4", ".m4v", ".mov"})
+_MKV_EXTENSIONS = frozenset({".mkv", ".webm"})
+
+_MP4_FOURCC_CODECS = {
+    b"hvc1": "hevc", b"hev1": "hevc", b"dvh1": "hevc", b"dvhe": "hevc",
+    b"avc1": "h264", b"avc3": "h264",
+    b"av01": "av1",  b"vp09": "vp9",  b"mp4v": "mpeg4",
+}
+_MKV_CODEC_IDS = {
+    "V_MPEGH/ISO/HEVC": "hevc", "V_MPEG4/ISO/AVC": "h264",
+    "V_AV1": "av1", "V_VP9": "vp9", "V_VP8": "vp8",
+    "V_MPEG2": "mpeg2video", "V_MPEG4/ISO/ASP": "mpeg4",
+}
+
+_EBML_HEADER     = 0x1A45DFA3
+_MKV_SEGMENT     = 0x18538067
+_MKV_TRACKS      = 0x1654AE6B
+_MKV_CLUSTER     = 0x1F43B675
+_MKV_TRACK_ENTRY = 0xAE
+_MKV_TRACK_TYPE  = 0x83
+_MKV_CODEC_ID    = 0x86
+
+def _mp4_boxes(f, start: int, end: int):
+    """Itereert (type, data_start, box_end) over de boxes tussen start en end."""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        hdr = f.read(8)
+        if len(hdr) < 8:
+            return
+        size, btype = struct.unpack(">I4s", hdr)
+        hlen = 8
+        if size == 1:  # 64-bit grootte
+            ext = f.read(8)
+            if len(ext) < 8:
+                return
+            size = struct.unpack(">Q", ext)[0]
+            hlen = 16
+        elif size == 0:  # loopt tot einde van de ouder
+            size = end - pos
+        if size < hlen:
+            return
+        yield btype, pos + hlen, pos + size
+        pos += size
+
+def _mp4_child(f, start: int, end: int, btype: bytes):
+    for t, s, e in _mp4_boxes(f, start, end):
+        if t == btype:
+            return s, e
+    return None
+
+def _mp4_video_codec(f, file_size: int) -> str | None:
+    """moov > trak > mdia (hdlr=vide) > minf > stbl > stsd → fourcc eerste entry."""
+    moov = _mp4_child(f, 0, file_size, b"moov")
+    if not moov:
+        return None
+    for t, ts, te in _mp4_boxes(f, *moov):
+        if t != b"trak":
+            continue
+        mdia = _mp4_child(f, ts, te, b"mdia")
+        hdlr = mdia and _mp4_child(f, *mdia, b"hdlr")
+        if not hdlr:
+            continue
+        f.seek(hdlr[0] + 8)  # version/flags + pre_defined
+        if f.read(4) != b"vide":
+            continue
+        box = mdia
+        for name in (b"minf", b"stbl", b"stsd"):
+            box = _mp4_child(f, *box, name)
+            if not box:
+                return None
+        f.seek(box[0] + 8)  # version/flags + entry_count
+        entry = f.read(8)
+        if len(entry) < 8:
+            return None
+        fourcc = entry[4:8]
+        return _MP4_FOURCC_CODECS.get(fourcc, fourcc.decode("latin-1").strip().lower())
+    return None
+
+def _ebml_vint(f, keep_marker: bool):
+    """Leest een EBML variable-length integer. Geeft (waarde, lengte) of (None, 0)."""
+    b = f.read(1)
+    if not b or b[0] == 0:
+        return None, 0
+    first = b[0]
+    length = 9 - first.bit_length()
+    value = first if keep_marker else first & (0xFF >> length)
+    rest = f.read(length - 1)
+    if len(rest) < length - 1:
+        return None, 0
+    for x in rest:
+        value = (value << 8) | x
+    return value, length
+
+def _mkv_elements(f, start: int, end: int):
+    """
+    Itereert (id, data_start, data_end) binnen [start, end) — data_end is None
+    bij onbekende grootte. Stopt bij een element dat voorbij `end` zou lopen
+    (corrupt of afgekapt bestand).
+    """
+    pos = start
+    while pos < end:
+        f.seek(pos)
+        eid, id_len = _ebml_vint(f, keep_marker=True)
+        if eid is None:
+            return
+        size, size_len = _ebml_vint(f, keep_marker=False)
+        if size is None:
+            return
+        data = pos + id_len + size_len
+        if size == (1 << (7 * size_len)) - 1:  # onbekende grootte (live/streaming mkv)
+            yield eid, data, None
+            return
+        if data + size > end:
+            return
+        yield eid, data, data + size
+        pos = data + size
+
+_MKV_MAX_TRACK_TYPE = 8   # bytes; een uinteger past altijd in 8 bytes
+_MKV_MAX_CODEC_ID   = 64  # bytes; echte CodecID's zijn hooguit ~20 tekens
+
+def _mkv_video_codec(f, file_size: int) -> str | None:
+    """EBML > Segment > Tracks > TrackEntry (TrackType=1) > CodecID."""
+    top = _mkv_elements(f, 0, file_size)
+    first = next(top, None)
+    if not first or first[0] != _EBML_HEADER:
+        return None
+    for eid, seg_start, seg_end in top:
+        if eid != _MKV_SEGMENT:
+            continue
+        for cid, cs, ce in _mkv_elements(f, seg_start, seg_end or file_size):
+            if cid == _MKV_CLUSTER or ce is None:
+                return None  # Tracks niet vóór de mediadata — laat ffprobe het doen
+            if cid != _MKV_TRACKS:
+                continue
+            for tid, ts, te in _mkv_elements(f, cs, ce):
+                if tid != _MKV_TRACK_ENTRY or te is None:
+                    continue
+                track_type = codec_id = None
+                for fid, fs, fe in _mkv_elements(f, ts, te):
+                    if fe is None:
+                        break
+                    if fid == _MKV_TRACK_TYPE:
+                        if fe - fs > _MKV_MAX_TRACK_TYPE:
+                            return None
+                        f.seek(fs)
+                        track_type = int.from_bytes(f.read(fe - fs), "big")
+                    elif fid == _MKV_CODEC_ID:
+                        if fe - fs > _MKV_MAX_CODEC_ID:
+                            return None
+                        f.seek(fs)
+                        codec_id = f.read(fe - fs).rstrip(b"\x00").decode("ascii", "replace")
+                if track_type == 1 and codec_id:
+                    return _MKV_CODEC_IDS.get(codec_id, codec_id.lower())
+            return None
+        return None
+    return None
+
+def fast_video_codec(file_path: str) -> str | None:
+    """
+    Leest de codec van de eerste videostream uit de MP4/MOV- of MKV-header.
+    Geeft None als het containerformaat niet ondersteund is of de header
+    niet te lezen valt — de aanroeper valt dan terug op ffprobe.
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext not in _MP4_EXTENSIONS and ext not in _MKV_EXTENSIONS:
+        return None
+    try:
+        with open(file_path, "rb") as f:
+            if ext in _MP4_EXTENSIONS:
+                return _mp4_video_codec(f, os.fstat(f.fileno()).st_size)
+            return _mkv_video_codec(f, os.fstat(f.fileno()).st_size)
+    except (OSError, ValueError, struct.error) as e:
+        logger.debug(f"Header lezen mislukt voor {file_path}: {e}")
+        return None
+
+def probe_video_codec(file_path: str) -> str | None:
     """
-    Controleert via ffprobe of het bestand al de doelcodec heeft.
-    Gebruikt -select_streams v:0 en een korte timeout voor snelle scan.
+    Codec van de eerste videostream: eerst via de containerheader, anders via
+    ffprobe. Geeft None als de codec niet te bepalen is.
+    Gooit subprocess.TimeoutExpired door als ffprobe vastloopt.
     """
+    codec = fast_video_codec(file_path)
+    if codec is not None:
+        return codec
     try:
+        # Eén kale regel uitvoer (alleen codec_name) — geen JSON te parsen
         result = subprocess.run([
-            "ffprobe", "-v", "quiet",
+            "ffprobe", "-v", "quiet", "-threads", "0",
             "-select_streams", "v:0",
             "-show_entries", "stream=codec_name",
-            "-print_format", "json",
+            "-of", "default=nw=1:nk=1",
             file_path
         ], capture_output=True, text=True, timeout=5)
-        if result.returncode != 0 or not result.stdout.strip():
-            return True  # Kan bestand niet lezen — voeg toe voor de zekerheid
-        info = json.loads(result.stdout)
-        for stream in info.get("streams", []):
-            current = stream.get("codec_name", "")
-            if "hevc" in target_codec and current in ("hevc", "h265"):
-                return False
-            if "h264" in target_codec and current == "h264":
-                return False
-        return True
+        if result.returncode != 0:
+            return None
+        codec = result.stdout.strip().splitlines()
+        return codec[0].strip() if codec else None
     except subprocess.TimeoutExpired:
-        logger.warning(f"ffprobe timeout bij {Path(file_path).name} — overgeslagen")
-        return False  # Timeout = sla over, niet toevoegen (voorkomt vastlopen)
+        raise
     except Exception as e:
         logger.warning(f"ffprobe fout bij {file_path}: {e}")
-        return True
+        return None
+
+class Codec(enum.IntEnum):
+    """Codecfamilie: doel van een profiel of gevonden codec van een bestand."""
+    OTHER = 0
+    HEVC  = 1
+    H264  = 2
+
+_CODEC_FAMILIES = {"hevc": Codec.HEVC, "h265": Codec.HEVC, "h264": Codec.H264}
+
+def target_codec_family(video_codec: str) -> Codec:
+    """Doelfamilie van een ffmpeg-encoder (hevc_nvenc, libx265, h264_qsv, ...)."""
+    if "hevc" in video_codec or "265" in video_codec:
+        return Codec.HEVC
+    if "h264" in video_codec or "264" in video_codec:
+        return Codec.H264
+    return Codec.OTHER
+
+def codec_needs_conversion(current: str | None, target: Codec) -> bool:
+    """Vergelijkt een gevonden codec met de doelfamilie (None = onbekend)."""
+    if current is None:
+        return True  # Kan bestand niet lezen — voeg toe voor de zekerheid
+    # OTHER als doel matcht nooit: dan altijd converteren
+    return target == Codec.OTHER or _CODEC_FAMILIES.get(current, Codec.OTHER) != target
+
+def needs_conversion(file_path: str, target: Codec) -> bool:
+    """
+    Controleert of het bestand al de doelcodec heeft.
+    MP4/MOV/MKV worden via de containerheader gelezen, overige via ffprobe
+    (-select_streams v:0 met een korte timeout voor snelle scan).
+    """
+    try:
+        current = probe_video_codec(file_path)
+    except subprocess.TimeoutExpired:
+        logger.warning(f"ffprobe timeout bij {Path(file_path).name} — overgeslagen")
+        return False  # Timeout = sla over, niet toevoegen (voorkomt vastlopen)
+    return codec_needs_conversion(current, target)
+
+def needs_conversion_cached(conn, file_path: str, target: Codec, cache_rows: list) -> bool:
+    """
+    needs_conversion voor losse bestanden (watcher) met codec_cache: een
+    ongewijzigd bestand (zelfde mtime en grootte) wordt niet opnieuw gelezen.
+    Een nieuw gevonden codec komt in `cache_rows`; de aanroeper schrijft die
+    weg, zodat er tijdens ffprobe geen schrijftransactie openstaat.
+    """
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return needs_conversion(file_path, target)
+    row = conn.execute("SELECT mtime, size, codec FROM codec_cache WHERE path=?", (file_path,)).fetchone()
+    if row and row["mtime"] == st.st_mtime_ns and row["size"] == st.st_size:
+        return codec_needs_conversion(row["codec"], target)
+    try:
+        current = probe_video_codec(file_path)
+    except subprocess.TimeoutExpired:
+        logger.warning(f"ffprobe timeout bij {Path(file_path).name} — overgeslagen")
+        return False
+    if current:
+        cache_rows.append((file_path, st.st_mtime_ns, st.st_size, current))
+    return codec_needs_conversion(current, target)
 
 # ── Scanner ───────────────────────────────────────────────────────────────────
-def scan_library(library_id: str):
+SCAN_BATCH_SIZE    = 500  # nieuwe wachtrij-items per transactie
+SCAN_PROBE_WORKERS = min(8, os.cpu_count() or 1)  # parallelle codec-controles
+SCAN_PROBE_WINDOW  = 256  # maximaal aantal bestanden tegelijk in behandeling
+
+def _iter_video_entries(path: str, deadline: float | None = None):
+    """
+    Loopt iteratief door een mapstructuur met os.scandir en levert een
+    DirEntry per videobestand. Verborgen bestanden/mappen worden overgeslagen,
+    symlinks naar mappen niet gevolgd. Onleesbare mappen worden gelogd en
+    overgeslagen zodat één kapotte map de hele scan niet stopt.
+    Met `deadline` (time.monotonic()) volgt TimeoutError zodra die verstreken is;
+    binnen grote mappen wordt elke 1000 entries opnieuw gecontroleerd.
+    """
+    stack = [path]
+    seen = 0
+    while stack:
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError(f"Doorlopen van {path} duurde te lang")
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    seen += 1
+                    if (deadline is not None and seen % 1000 == 0
+                            and time.monotonic() > deadline):
+                        raise TimeoutError(f"Doorlopen van {path} duurde te lang")
+                    name = entry.name
+                    if name.startswith('.'):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                            continue
+                        if not (name.endswith(_VIDEO_SUFFIX_TUPLE)
+                                or name.lower().endswith(_VIDEO_SUFFIX_TUPLE)):
+                            continue
+                        if entry.is_file():
+                            yield entry
+                    except OSError:
+                        continue
+        except TimeoutError:
+            raise  # subklasse van OSError, niet als onleesbare map behandelen
+        except OSError as e:
+            logger.warning(f"Scan: kan map niet lezen: {current}: {e}")
+
+def publish_scan_status(library_id: str, status: dict):
+    """Publiceert een kopie van `status` als nieuwe snapshot in scan_status."""
     global scan_status
+    with _scan_status_lock:
+        new = dict(scan_status)
+        new[library_id] = MappingProxyType(dict(status))
+        scan_status = MappingProxyType(new)
+
+def scan_library(library_id: str):
     conn = get_db()
     lib = conn.execute("SELECT * FROM libraries WHERE id=?", (library_id,)).fetchone()
     if not lib:
@@ -552,15 +1161,28 @@ def scan_library(library_id: str):
         return
 
     path = lib["path"]
-    scan_status[library_id] = {
+    # Lokale, veranderlijke status; zichtbaar via publish() (hooguit elke
+    # SCAN_STATUS_PUBLISH_INTERVAL tijdens het doorlopen, altijd bij begin/einde)
+    status = {
         "status": "scanning", "scanned": 0, "added": 0,
         "skipped": 0, "already_converted": 0,
         "current_file": "", "path": path, "error": None
     }
+    last_publish = 0.0
+
+    def publish(force: bool = False):
+        nonlocal last_publish
+        now_mono = time.monotonic()
+        if force or now_mono - last_publish >= SCAN_STATUS_PUBLISH_INTERVAL:
+            last_publish = now_mono
+            publish_scan_status(library_id, status)
+
+    publish(force=True)
 
     if not os.path.isdir(path):
-        scan_status[library_id]["status"] = "error"
-        scan_status[library_id]["error"] = f"Map niet gevonden: {path}"
+        status["status"] = "error"
+        status["error"] = f"Map niet gevonden: {path}"
+        publish(force=True)
         logger.error(f"Scan {library_id}: map niet gevonden: {path}")
         conn.close()
         return
@@ -570,26 +1192,133 @@ def scan_library(library_id: str):
         top_entries = os.listdir(path)
         logger.info(f"Scan {library_id}: map '{path}' heeft {len(top_entries)} items: {top_entries[:10]}")
     except Exception as e:
-        scan_status[library_id]["status"] = "error"
-        scan_status[library_id]["error"] = f"Kan map niet lezen: {e}"
+        status["status"] = "error"
+        status["error"] = f"Kan map niet lezen: {e}"
+        publish(force=True)
         logger.error(f"Scan {library_id}: kan map niet lezen: {e}")
         conn.close()
         return
 
     added = skipped = already_converted = scanned = 0
 
-    for root, dirs, files in os.walk(path):
-        # Skip hidden directories
-        dirs[:] = [d for d in dirs if not d.startswith('.')]
-        for fname in files:
-          try:
-            ext = Path(fname).suffix.lower()
-            if ext not in VIDEO_EXTENSIONS:
-                continue
-            fpath = os.path.join(root, fname)
-            # Sla tijdelijke Shrync-bestanden over (shryncing-*.mkv)
+    # Dedup-sets vooraf in één keer laden i.p.v. drie SELECTs per bestand
+    queued_paths = {r["file_path"] for r in conn.execute(
+        "SELECT file_path FROM queue WHERE status IN ('pending','processing')")}
+    done_paths = {r["file_path"] for r in conn.execute(
+        "SELECT file_path FROM history WHERE status IN ('success','skipped')")}
+    failed_paths = {r["file_path"] for r in conn.execute(
+        "SELECT file_path FROM history WHERE status='error'")}
+    # Bekende codecs voor deze bibliotheek (bereik op de primaire sleutel)
+    lib_prefix = os.path.join(path, "")
+    codec_cache = {r["path"]: (r["mtime"], r["size"], r["codec"]) for r in conn.execute(
+        "SELECT path, mtime, size, codec FROM codec_cache WHERE path >= ? AND path < ?",
+        (lib_prefix, lib_prefix[:-1] + chr(ord(lib_prefix[-1]) + 1)))}
+
+    # Nieuwe wachtrij-items worden gebundeld weggeschreven: één transactie
+    # (en één fsync) per batch i.p.v. per bestand. Per batch committen zodat
+    # de dispatcher bij grote bibliotheken niet op het einde van de scan wacht.
+    insert_rows = []
+    retry_paths = set()   # paden in insert_rows met een oude foutmelding
+    cache_rows = []   # nieuw gevonden codecs voor codec_cache
+
+    # Doelcodec één keer per scan bepalen, niet per bestand
+    global_codec, _, _, _ = profile_to_ffmpeg(get_global_setting('conversion_profile', 'nvenc_max'))
+    target = target_codec_family(global_codec)
+
+    def flush_batch():
+        nonlocal added, skipped
+        if not insert_rows and not cache_rows:
+            return
+        try:
+            # Per rij invoegen (nog steeds één transactie): INSERT OR IGNORE slaat
+            # paden over die intussen door de watcher of de API zijn toegevoegd,
+            # en alleen echt ingevoegde rijen tellen mee of wissen hun foutmelding.
+            inserted = []
+            for row in insert_rows:
+                if conn.execute(
+                    "INSERT OR IGNORE INTO queue (id,library_id,file_path,file_size,status) VALUES (?,?,?,?,'pending')",
+                    row
+                ).rowcount:
+                    inserted.append(row[2])
+            retried = [(p,) for p in inserted if p in retry_paths]
+            if retried:
+                conn.executemany("DELETE FROM history WHERE file_path=? AND status='error'", retried)
+            if cache_rows:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO codec_cache (path, mtime, size, codec) VALUES (?,?,?,?)",
+                    cache_rows
+                )
+            conn.commit()
+            added += len(inserted)
+            skipped += len(insert_rows) - len(inserted)
+            status["added"] = added
+            status["skipped"] = skipped
+            for fpath, in retried:
+                logger.info(f"Scan: mislukte conversie opnieuw toegevoegd: {fpath}")
+            if inserted:
+                notify_queue()
+        except sqlite3.Error as e:
+            conn.rollback()
+            queued_paths.difference_update(row[2] for row in insert_rows)
+            logger.error(f"Scan {library_id}: wegschrijven van {len(insert_rows)} wachtrij-item(s) mislukt: {e}")
+        insert_rows.clear()
+        retry_paths.clear()
+        cache_rows.clear()
+
+    # Codec-controle (header-lezen of ffprobe) loopt parallel in een begrensde
+    # threadpool; deze thread blijft de enige die naar de database schrijft.
+    # Maximaal SCAN_PROBE_WINDOW bestanden tegelijk onderweg (backpressure).
+    in_flight = collections.deque()
+
+    def handle_probe(fpath: str, fname: str, st, result):
+        """`result` is een codec uit codec_cache (str) of een Future van probe_video_codec."""
+        nonlocal already_converted
+        try:
+            if isinstance(result, str):
+                needs = codec_needs_conversion(result, target)
+            else:
+                try:
+                    current = result.result()
+                except subprocess.TimeoutExpired:
+                    logger.warning(f"ffprobe timeout bij {fname} — overgeslagen")
+                    needs = False  # Timeout = sla over, niet toevoegen (voorkomt vastlopen)
+                else:
+                    needs = codec_needs_conversion(current, target)
+                    if current:
+                        cache_rows.append((fpath, st.st_mtime_ns, st.st_size, current))
+                        if len(cache_rows) >= SCAN_BATCH_SIZE:
+                            flush_batch()
+            if not needs:
+                already_converted += 1
+                status["already_converted"] = already_converted
+                status["last_skip"] = {"file": fname, "reason": "codec_match", "codec": global_codec}
+                return
+
+            # Mislukte conversie: verwijder oude foutmelding en voeg opnieuw toe
+            # (skipped wordt al hierboven afgehandeld — hier alleen errors)
+            if fpath in failed_paths:
+                retry_paths.add(fpath)
+
+            jid = uuid7()
+            insert_rows.append((jid, library_id, fpath, st.st_size))
+            queued_paths.add(fpath)
+            if len(insert_rows) >= SCAN_BATCH_SIZE:
+                flush_batch()
+        except Exception as _scan_exc:
+            logger.warning(f"Scan: fout bij verwerken {fname}: {_scan_exc}")
+
+    probe_pool = ThreadPoolExecutor(max_workers=SCAN_PROBE_WORKERS,
+                                    thread_name_prefix=f"Probe-{library_id[:8]}")
+    # os.scandir levert naam, pad en type in één getdents-ronde; per bestand
+    # is alleen nog de stat() voor de grootte nodig (geen losse getsize meer)
+    for entry in _iter_video_entries(path):
+        publish()
+        fname = entry.name
+        try:
+            # Sla tijdelijke Shrync-bestanden over (shryncing-*.mkv, ook remux)
             if fname.startswith("shryncing-"):
                 continue
+            fpath = entry.path
             # Uitsluitingspatronen toepassen (per bibliotheek)
             # lib is een sqlite3.Row — gebruik try/except voor kolommen
             # die mogelijk niet bestaan in oudere databases
@@ -602,8 +1331,8 @@ def scan_library(library_id: str):
                 try:
                     if re.search(pat, fname, re.IGNORECASE):
                         excluded = True
-                        scan_status[library_id]["skipped"] = scan_status[library_id].get("skipped", 0) + 1
-                        scan_status[library_id]["last_skip"] = {"file": fname, "reason": "excluded_pattern", "pattern": pat}
+                        status["skipped"] = status.get("skipped", 0) + 1
+                        status["last_skip"] = {"file": fname, "reason": "excluded_pattern", "pattern": pat}
                         logger.debug(f"Scan: uitgesloten door patroon '{pat}': {fname}")
                         break
                 except re.error as e:
@@ -611,75 +1340,53 @@ def scan_library(library_id: str):
             if excluded:
                 continue
             scanned += 1
-            scan_status[library_id]["scanned"] = scanned
-            scan_status[library_id]["current_file"] = fname
+            status["scanned"] = scanned
+            status["current_file"] = fname
             logger.debug(f"Scan: gevonden: {fpath}")
 
-            existing = conn.execute(
-                "SELECT id FROM queue WHERE file_path=? AND status IN ('pending','processing')", (fpath,)
-            ).fetchone()
-            if existing:
+            if fpath in queued_paths:
                 skipped += 1
-                scan_status[library_id]["skipped"] = skipped
-                scan_status[library_id]["last_skip"] = {"file": fname, "reason": "already_queued"}
+                status["skipped"] = skipped
+                status["last_skip"] = {"file": fname, "reason": "already_queued"}
                 continue
 
-            done = conn.execute(
-                "SELECT id FROM history WHERE file_path=? AND status IN ('success','skipped')", (fpath,)
-            ).fetchone()
-            if done:
+            if fpath in done_paths:
                 skipped += 1
-                scan_status[library_id]["skipped"] = skipped
-                scan_status[library_id]["last_skip"] = {"file": fname, "reason": "already_converted"}
+                status["skipped"] = skipped
+                status["last_skip"] = {"file": fname, "reason": "already_converted"}
                 continue
 
-            # Mislukte conversie: verwijder oude foutmelding en voeg opnieuw toe
-            # (skipped wordt al hierboven afgehandeld — hier alleen errors)
-            failed = conn.execute(
-                "SELECT id FROM history WHERE file_path=? AND status='error'", (fpath,)
-            ).fetchone()
-            if failed:
-                conn.execute("DELETE FROM history WHERE file_path=? AND status='error'", (fpath,))
-                conn.commit()
-                logger.info(f"Scan: mislukte conversie opnieuw toegevoegd: {fpath}")
-
-            profile_id = get_global_setting('conversion_profile', 'nvenc_max')
-            global_codec, _, _, _ = profile_to_ffmpeg(profile_id)
-            if not needs_conversion(fpath, global_codec):
-                already_converted += 1
-                scan_status[library_id]["already_converted"] = already_converted
-                scan_status[library_id]["last_skip"] = {"file": fname, "reason": "codec_match", "codec": global_codec}
-                continue
-
-            fsize = os.path.getsize(fpath)
-            jid = str(uuid.uuid4())
-            conn.execute(
-                "INSERT INTO queue (id,library_id,file_path,file_size,status) VALUES (?,?,?,?,'pending')",
-                (jid, library_id, fpath, fsize)
-            )
-            conn.commit()   # direct committen zodat de worker het meteen oppakt
-            added += 1
-            scan_status[library_id]["added"] = added
-          except Exception as _scan_exc:
+            st = entry.stat()
+            cached = codec_cache.get(fpath)
+            if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+                # Ongewijzigd sinds de vorige controle — niet opnieuw lezen
+                in_flight.append((fpath, fname, st, cached[2]))
+            else:
+                in_flight.append((fpath, fname, st, probe_pool.submit(probe_video_codec, fpath)))
+            if len(in_flight) >= SCAN_PROBE_WINDOW:
+                handle_probe(*in_flight.popleft())
+        except Exception as _scan_exc:
             logger.warning(f"Scan: fout bij verwerken {fname}: {_scan_exc}")
 
+    while in_flight:
+        handle_probe(*in_flight.popleft())
+    probe_pool.shutdown()
+    flush_batch()
     conn.execute("UPDATE libraries SET last_scan=? WHERE id=?", (datetime.now(timezone.utc).isoformat(), library_id))
     conn.commit()
     conn.close()
-    scan_status[library_id]["status"] = "done"
-    scan_status[library_id]["current_file"] = ""
+    status["status"] = "done"
+    status["current_file"] = ""
+    publish(force=True)
     logger.info(f"Scan {library_id}: {scanned} gescand, {added} toegevoegd, {skipped} overgeslagen, {already_converted} al H.265")
 
 # ── Conversion ────────────────────────────────────────────────────────────────
-def run_conversion(job_id: str):
+PROGRESS_UPDATE_INTERVAL = 1.0  # seconden tussen voortgangsupdates in de DB
+
+def run_conversion(job: dict):
+    """Converteert een door claim_next_job() geclaimde job (id, file_path, library_id)."""
+    job_id = job["id"]
     conn = get_db()
-    job = conn.execute(
-        "SELECT q.* FROM queue q WHERE q.id=?",
-        (job_id,)
-    ).fetchone()
-    if not job:
-        conn.close()
-        return
 
     src = job["file_path"]
     if not os.path.exists(src):
@@ -690,7 +1397,7 @@ def run_conversion(job_id: str):
         return
 
     # Tijdelijk bestand altijd naast het bronbestand — zelfde map, willekeurige naam
-    _src_dir = str(Path(src).parent)
+    _src_dir, _src_name = os.path.split(src)
     _rand    = str(uuid.uuid4()).replace("-", "")[:12]
     tmp_out  = os.path.join(_src_dir, f"shryncing-{_rand}.mkv")
     logger.info(f"Tijdelijk bestand: {tmp_out}")
@@ -699,17 +1406,16 @@ def run_conversion(job_id: str):
     video_codec, preset, quality, _ = profile_to_ffmpeg(profile)
     audio_codec = get_global_setting('audio_codec', 'copy')
 
-    # Lees filmduur via ffprobe — alleen format sectie, snelle header read
+    # Lees filmduur via ffprobe — alleen format=duration als kale waarde
     duration = 0
     try:
         r = subprocess.run(
-            ["ffprobe", "-v", "quiet",
+            ["ffprobe", "-v", "quiet", "-threads", "0",
              "-show_entries", "format=duration",
-             "-print_format", "json", src],
+             "-of", "default=nw=1:nk=1", src],
             capture_output=True, text=True, timeout=10
         )
-        info = json.loads(r.stdout)
-        duration = float(info.get("format", {}).get("duration", 0))
+        duration = float(r.stdout.strip() or 0)
     except:
         pass
 
@@ -750,23 +1456,27 @@ def run_conversion(job_id: str):
         cmd = build_cpu_cmd(src, tmp_out, effective_codec, preset, quality, audio_codec, hdr_info)
 
     original_size = os.path.getsize(src)
-    conn.execute("UPDATE queue SET status='processing', started_at=?, original_size=?, profile_id=? WHERE id=?",
-                 (datetime.now(timezone.utc).isoformat(), original_size, profile, job_id))
+    conn.execute("UPDATE queue SET original_size=?, profile_id=? WHERE id=?",
+                 (original_size, profile, job_id))
     conn.commit()
 
     start_time = time.time()
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1)
+    # Binaire pipes met een ruime buffer: progress-regels worden als bytes
+    # vergeleken en alleen de getallen worden geparsed, geen tekst-decodering
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=65536)
 
     slot_id = threading.current_thread().name
     with active_jobs_lock:
-        active_jobs[slot_id] = {"id": job_id, "process": process}
+        active_jobs[slot_id] = jid_to_slot[job_id] = {"id": job_id, "process": process}
 
-    stderr_lines = []
+    # Alleen de staart van stderr is nodig voor de foutmelding — een ringbuffer
+    # houdt het geheugen begrensd, ook bij encodes van uren
+    stderr_tail = collections.deque(maxlen=64)
 
     # Lees stderr in aparte thread zodat de pipe-buffer niet blokkeert
     def read_stderr():
         for line in process.stderr:
-            stderr_lines.append(line)
+            stderr_tail.append(line)
     stderr_thread = threading.Thread(target=read_stderr, daemon=True)
     stderr_thread.start()
 
@@ -774,18 +1484,23 @@ def run_conversion(job_id: str):
         # Buffer per progress-blok: ffmpeg schrijft keys in vaste volgorde,
         # eindigend met "progress=". Pas na het complete blok berekenen we
         # ETA zodat out_time_us en fps altijd van hetzelfde moment zijn.
-        blok: dict = {}
+        out_time_raw = fps_raw = b"0"
+        last_update = 0.0
         for line in process.stdout:
-            line = line.strip()
-            if "=" not in line:
-                continue
-            key, _, val = line.partition("=")
-            blok[key] = val
-            if key == "progress":
-                # Volledig blok ontvangen — verwerk
+            if line.startswith(b"out_time_us="):
+                out_time_raw = line[12:]
+            elif line.startswith(b"fps="):
+                fps_raw = line[4:]
+            elif line.startswith(b"progress="):
+                # Volledig blok ontvangen — verwerk, maar schrijf hooguit
+                # één keer per seconde naar de database
+                now_mono = time.monotonic()
+                if now_mono - last_update < PROGRESS_UPDATE_INTERVAL:
+                    continue
+                last_update = now_mono
                 try:
-                    out_time_us = int(blok.get("out_time_us", 0))
-                    fps_val     = float(blok.get("fps", 0))
+                    out_time_us = int(out_time_raw)   # int()/float() accepteren bytes
+                    fps_val     = float(fps_raw)
                     progress    = 0
                     eta         = ""
                     if duration > 0 and out_time_us > 0:
@@ -794,24 +1509,22 @@ def run_conversion(job_id: str):
                         if fps_val > 0:
                             remaining_sec = int((duration - current_sec) / fps_val)
                             eta = f"{remaining_sec // 60}m{remaining_sec % 60}s"
-                    conn2 = get_db()
-                    conn2.execute("UPDATE queue SET progress=?, fps=?, eta=? WHERE id=?",
-                                  (progress, fps_val, eta, job_id))
-                    conn2.commit()
-                    conn2.close()
+                    conn.execute("UPDATE queue SET progress=?, fps=?, eta=? WHERE id=?",
+                                 (progress, fps_val, eta, job_id))
+                    conn.commit()
                 except:
                     pass
-                blok = {}  # reset voor volgend blok
         process.wait()
     except Exception as e:
         process.kill()
         logger.error(f"Conversie fout: {e}")
 
     stderr_thread.join(timeout=30)
-    stderr_out = "".join(stderr_lines)
+    stderr_out = b"".join(stderr_tail).decode("utf-8", "replace")
 
     with active_jobs_lock:
         active_jobs.pop(slot_id, None)
+        jid_to_slot.pop(job_id, None)
 
     elapsed = int(time.time() - start_time)
     now = datetime.now(timezone.utc).isoformat()
@@ -823,16 +1536,19 @@ def run_conversion(job_id: str):
         # - bij .mp4/.avi/.ts/.wmv/.flv/.mov: remux naar MKV zonder hercodering
         #   (alleen containerwijziging, geen kwaliteitsverlies, geen hercodering)
         # - bij .mkv: origineel behouden, als skipped markeren
-        src_ext = Path(src).suffix.lower()
+        _src_stem, src_ext = os.path.splitext(src)
+        src_ext = src_ext.lower()
         non_mkv_extensions = {".mp4", ".avi", ".ts", ".wmv", ".flv", ".mov", ".m4v"}
 
         if new_size >= original_size and src_ext in non_mkv_extensions:
             # Remux naar MKV — alleen containerwissel, geen hercodering
             try: os.remove(tmp_out)
             except: pass
-            mkv_out = str(Path(src).with_suffix(".mkv"))
-            tmp_remux = os.path.join(str(Path(src).parent), f"remux-{_rand}.mkv")
-            logger.info(f"Geconverteerd groter dan origineel — remux {src_ext} → MKV: {Path(src).name}")
+            mkv_out = _src_stem + ".mkv"
+            # shryncing-prefix: scanner en watcher slaan het over en
+            # cleanup_stale_conversions() ruimt het op na een herstart
+            tmp_remux = os.path.join(_src_dir, f"shryncing-remux-{_rand}.mkv")
+            logger.info(f"Geconverteerd groter dan origineel — remux {src_ext} → MKV: {_src_name}")
             remux_cmd = [
                 "ffmpeg", "-y", "-i", src,
                 "-map", "0",
@@ -1531,12 +2247,124 @@ def subtitle_dispatcher_loop():
     logger.info("Ondertitel dispatcher gestopt.")
 
 # ── File watcher ──────────────────────────────────────────────────────────────
+# Nieuwe bestanden worden niet per bestand in een eigen slapende thread
+# gevolgd: één achtergrondthread controleert alle openstaande bestanden elke
+# WATCH_TICK_SECONDS met één os.stat per bestand. Een bestand is klaar met
+# kopiëren als grootte en mtime WATCH_STABLE_TICKS ticks lang ongewijzigd zijn.
+WATCH_TICK_SECONDS = 5
+WATCH_STABLE_TICKS = 2
+WATCH_MAX_WAIT     = 30 * 60  # maximaal 30 minuten wachten op een stabiel bestand
+
+_watch_pending = {}   # fpath -> [library_id, size, mtime_ns, eerst_gezien, stabiele_ticks]
+_watch_cv = threading.Condition()
+_watch_thread = None
+# Codec-controle + database-insert van stabiele bestanden draait op een vaste,
+# begrensde pool zodat de stabiliteitscontrole niet op ffprobe hoeft te wachten
+_watch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="shrync-watch")
+
+def schedule_stability_check(library_id: str, fpath: str):
+    """Volg `fpath` tot het stabiel is; een nieuw event begint de telling opnieuw."""
+    global _watch_thread
+    with _watch_cv:
+        _watch_pending[fpath] = [library_id, -1, -1, time.monotonic(), 0]
+        if _watch_thread is None or not _watch_thread.is_alive():
+            _watch_thread = threading.Thread(target=_watch_stability_loop,
+                                             name="WatchStability", daemon=True)
+            _watch_thread.start()
+        _watch_cv.notify()
+
+def _watch_stability_loop():
+    while True:
+        with _watch_cv:
+            while not _watch_pending:
+                _watch_cv.wait()
+            snapshot = list(_watch_pending.items())
+        time.sleep(WATCH_TICK_SECONDS)
+        now = time.monotonic()
+        stable, done = [], []
+        for fpath, entry in snapshot:
+            library_id, last_size, last_mtime, first_seen, ticks = entry
+            try:
+                st = os.stat(fpath)
+            except OSError as e:
+                logger.warning(f"Watcher: bestand niet leesbaar: {fpath} — {e}")
+                done.append((fpath, entry))
+                continue
+            if st.st_size == last_size and st.st_mtime_ns == last_mtime and st.st_size > 0:
+                ticks += 1
+            else:
+                ticks = 0
+                logger.debug(f"Watcher: bestand nog bezig ({last_size} → {st.st_size}): {fpath}")
+            if ticks >= WATCH_STABLE_TICKS:
+                stable.append((library_id, fpath, st.st_size))
+                done.append((fpath, entry))
+            elif now - first_seen > WATCH_MAX_WAIT:
+                logger.warning(f"Watcher: timeout wachten op stabiel bestand: {fpath}")
+                done.append((fpath, entry))
+            else:
+                entry[1:] = [st.st_size, st.st_mtime_ns, first_seen, ticks]
+        with _watch_cv:
+            for fpath, entry in done:
+                # Alleen verwijderen als er intussen geen nieuwer event kwam
+                if _watch_pending.get(fpath) is entry:
+                    del _watch_pending[fpath]
+                else:
+                    stable = [x for x in stable if x[1] != fpath]
+        if stable:
+            _watch_executor.submit(_queue_stable_files_safe, stable)
+
+def _queue_stable_files_safe(files: list):
+    try:
+        queue_stable_files(files)
+    except Exception as e:
+        logger.error(f"Watcher: toevoegen aan wachtrij mislukt: {e}")
+
+def queue_stable_files(files: list):
+    """Voegt stabiele bestanden [(library_id, fpath, size)] in één transactie toe."""
+    conn = get_db()
+    try:
+        global_codec, _, _, _ = profile_to_ffmpeg(get_global_setting('conversion_profile', 'nvenc_max'))
+        target = target_codec_family(global_codec)
+        known_libs = {r["id"] for r in conn.execute("SELECT id FROM libraries")}
+        rows = []
+        cache_rows = []
+        for library_id, fpath, fsize in files:
+            if library_id not in known_libs:
+                continue
+            existing = conn.execute(
+                "SELECT 1 FROM queue WHERE file_path=? AND status IN ('pending','processing') LIMIT 1", (fpath,)
+            ).fetchone()
+            done = conn.execute(
+                "SELECT 1 FROM history WHERE file_path=? AND status='success' LIMIT 1", (fpath,)
+            ).fetchone()
+            if existing or done or not needs_conversion_cached(conn, fpath, target, cache_rows):
+                continue
+            rows.append((uuid7(), library_id, fpath, fsize))
+        if cache_rows:
+            conn.executemany("INSERT OR REPLACE INTO codec_cache (path, mtime, size, codec) VALUES (?,?,?,?)",
+                             cache_rows)
+        # Per rij invoegen (zelfde transactie) zodat alleen rijen die de unieke
+        # index echt accepteert gelogd worden — zoals de scan-flush
+        inserted = []
+        for row in rows:
+            if conn.execute(
+                "INSERT OR IGNORE INTO queue (id,library_id,file_path,file_size,status) VALUES (?,?,?,?,'pending')",
+                row
+            ).rowcount:
+                inserted.append(row[2])
+        conn.commit()
+        if not inserted:
+            return
+    finally:
+        conn.close()
+    notify_queue()
+    for fpath in inserted:
+        logger.info(f"Watcher: bestand toegevoegd aan wachtrij: {fpath}")
+
 class LibraryWatcher(FileSystemEventHandler):
     def __init__(self, library_id: str, library_path: str):
         self.library_id = library_id
         self.library_path = library_path
-        self._pending = {}
-        self._lock = threading.Lock()
 
     def on_created(self, event):
         if event.is_directory:
@@ -1549,69 +2377,42 @@ class LibraryWatcher(FileSystemEventHandler):
         self._handle(event.dest_path)
 
     def _handle(self, fpath: str):
-        if Path(fpath).suffix.lower() not in VIDEO_EXTENSIONS:
+        if not (fpath.endswith(_VIDEO_SUFFIX_TUPLE) or fpath.lower().endswith(_VIDEO_SUFFIX_TUPLE)):
             return
-        # Bestanden in de cache map negeren
-        if Path(fpath).name.startswith("shryncing-"):
+        # Tijdelijke Shrync-bestanden negeren
+        if os.path.basename(fpath).startswith("shryncing-"):
             return
-        with self._lock:
-            self._pending[fpath] = time.time()
-        threading.Thread(target=self._delayed_queue, args=(fpath,), daemon=True).start()
+        schedule_stability_check(self.library_id, fpath)
         logger.info(f"Watcher: nieuw bestand gedetecteerd: {fpath}")
 
-    def _delayed_queue(self, fpath: str):
-        # Wacht tot het bestand stabiel is (klaar met kopiëren)
-        # Maximaal 30 minuten wachten, check elke 15 seconden
-        max_wait = 30 * 60
-        waited = 0
-        time.sleep(10)  # eerste wacht
-        while waited < max_wait:
-            with self._lock:
-                if fpath not in self._pending:
-                    return  # geannuleerd door een nieuwer event
-            try:
-                size1 = os.path.getsize(fpath)
-                time.sleep(15)
-                size2 = os.path.getsize(fpath)
-                if size1 == size2 and size1 > 0:
-                    break  # bestand is stabiel
-                waited += 15
-                logger.debug(f"Watcher: bestand nog bezig ({size1} → {size2}): {fpath}")
-            except Exception as e:
-                logger.warning(f"Watcher: bestand niet leesbaar: {fpath} — {e}")
-                return
-        else:
-            logger.warning(f"Watcher: timeout wachten op stabiel bestand: {fpath}")
-            return
 
-        with self._lock:
-            if fpath not in self._pending:
-                return
-            del self._pending[fpath]
+# Lokale bestandssystemen leveren inotify-events; netwerkshares (NFS/CIFS),
+# FUSE en overlay-mounts niet betrouwbaar — daar blijft polling nodig.
+_INOTIFY_FSTYPES = frozenset({"ext4", "xfs", "btrfs", "zfs", "apfs", "ntfs"})
 
-        conn = get_db()
-        existing = conn.execute(
-            "SELECT id FROM queue WHERE file_path=? AND status IN ('pending','processing')", (fpath,)
-        ).fetchone()
-        done = conn.execute(
-            "SELECT id FROM history WHERE file_path=? AND status='success'", (fpath,)
-        ).fetchone()
-        if existing or done:
-            conn.close()
-            return
-        lib = conn.execute("SELECT * FROM libraries WHERE id=?", (self.library_id,)).fetchone()
-        global_codec, _, _, _ = profile_to_ffmpeg(get_global_setting('conversion_profile', 'nvenc_max'))
-        if not lib or not needs_conversion(fpath, global_codec):
-            conn.close()
-            return
-        fsize = os.path.getsize(fpath)
-        jid = str(uuid.uuid4())
-        conn.execute("INSERT INTO queue (id,library_id,file_path,file_size,status) VALUES (?,?,?,?,'pending')",
-                     (jid, self.library_id, fpath, fsize))
-        conn.commit()
-        conn.close()
-        logger.info(f"Watcher: bestand toegevoegd aan wachtrij: {fpath}")
+def _mount_fstype(path: str) -> str:
+    """Bestandssysteemtype van de mount waar `path` op staat (via /proc/mounts)."""
+    real = os.path.realpath(path)
+    best_mnt, best_type = "", ""
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                # /proc/mounts escapet spaties e.d. als \040
+                mnt = re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), parts[1])
+                if (real == mnt or real.startswith(mnt.rstrip("/") + "/")) and len(mnt) >= len(best_mnt):
+                    best_mnt, best_type = mnt, parts[2]
+    except OSError:
+        pass
+    return best_type
 
+def get_watch_interval() -> int:
+    try:
+        return max(5, int(get_global_setting('watch_interval', '60')))
+    except:
+        return 60
 
 def start_watchers():
     global _observers
@@ -1629,11 +2430,25 @@ def start_watchers():
             logger.warning(f"Watcher: map niet gevonden: {lib['path']}")
             continue
         handler = LibraryWatcher(lib["id"], lib["path"])
-        observer = PollingObserver(timeout=10)  # controleer elke 10 seconden
-        observer.schedule(handler, lib["path"], recursive=True)
-        observer.start()
+        fstype = _mount_fstype(lib["path"])
+        observer = None
+        if fstype in _INOTIFY_FSTYPES:
+            try:
+                observer = Observer()
+                observer.schedule(handler, lib["path"], recursive=True)
+                observer.start()
+                logger.info(f"Inotify watcher gestart ({fstype}): {lib['path']}")
+            except Exception as e:
+                # Bijv. fs.inotify.max_user_watches bereikt — val terug op polling
+                logger.warning(f"Inotify watcher mislukt voor {lib['path']}: {e} — polling gebruikt")
+                observer = None
+        if observer is None:
+            interval = get_watch_interval()
+            observer = PollingObserver(timeout=interval)
+            observer.schedule(handler, lib["path"], recursive=True)
+            observer.start()
+            logger.info(f"Polling watcher gestart ({fstype or 'onbekend'}, elke {interval}s): {lib['path']}")
         _observers.append(observer)
-        logger.info(f"Polling watcher gestart: {lib['path']}")
 
 # ── Dynamische worker dispatcher ─────────────────────────────────────────────
 # Geen vaste worker-threads — een dispatcher controleert de wachtrij en start
@@ -1652,18 +2467,38 @@ def update_semaphore():
         _job_semaphore = threading.Semaphore(n)
     logger.info(f"Worker limiet ingesteld op {n}")
 
-def run_job_thread(job_id: str):
+def run_job_thread(job: dict):
     """Voert één conversie uit en geeft de semaphore daarna vrij."""
     try:
-        run_conversion(job_id)
+        run_conversion(job)
     finally:
         _job_semaphore.release()
-        logger.debug(f"Job {job_id[:8]} klaar — slot vrijgegeven")
+        notify_queue()
+        logger.debug(f"Job {job['id'][-8:]} klaar — slot vrijgegeven")
+
+def claim_next_job() -> dict | None:
+    """
+    Claimt atomair de oudste pending job: één UPDATE ... RETURNING zet de
+    status op 'processing' en geeft de rij terug. Een geclaimde rij is niet
+    meer 'pending', dus twee claims kunnen nooit dezelfde job opleveren.
+    """
+    conn = get_db()
+    try:
+        row = conn.execute(
+            "UPDATE queue SET status='processing', started_at=? "
+            "WHERE id=(SELECT id FROM queue WHERE status='pending' ORDER BY added_at ASC, id ASC LIMIT 1) "
+            "RETURNING id, file_path, library_id",
+            (datetime.now(timezone.utc).isoformat(),)
+        ).fetchone()
+        conn.commit()
+    finally:
+        conn.close()
+    return dict(row) if row else None
 
 def dispatcher_loop():
     """
     Centrale dispatcher — draait als één achtergrond-thread.
-    Polt de wachtrij en start per beschikbare job een losse thread,
+    Claimt jobs uit de wachtrij en start per job een losse thread,
     begrensd door de semaphore (= max_workers).
     """
     logger.info("Dispatcher gestart.")
@@ -1672,59 +2507,30 @@ def dispatcher_loop():
             time.sleep(1)
             continue
         try:
-            # Haal alle job-ids op die al actief zijn (in geheugen én in DB)
-            with active_jobs_lock:
-                active_ids = [v["id"] for v in active_jobs.values()]
-
-            conn2 = get_db()
-            # Sluit zowel 'processing' (DB) als actieve in-memory jobs uit
-            skip_ids = active_ids[:]
-            processing_in_db = [r["id"] for r in conn2.execute(
-                "SELECT id FROM queue WHERE status='processing'"
-            ).fetchall()]
-            for pid in processing_in_db:
-                if pid not in skip_ids:
-                    skip_ids.append(pid)
-
-            if skip_ids:
-                placeholders = ",".join("?" * len(skip_ids))
-                job = conn2.execute(
-                    f"SELECT id FROM queue WHERE status='pending' AND id NOT IN ({placeholders}) "
-                    f"ORDER BY added_at ASC LIMIT 1", skip_ids
-                ).fetchone()
-            else:
-                job = conn2.execute(
-                    "SELECT id FROM queue WHERE status='pending' ORDER BY added_at ASC LIMIT 1"
-                ).fetchone()
-            conn2.close()
-
-            if job:
-                # Probeer een slot te bemachtigen (non-blocking)
-                acquired = _job_semaphore.acquire(blocking=False)
-                if acquired:
-                    # Zet status meteen op 'processing' in DB zodat de dispatcher
-                    # dit item niet nogmaals oppakt vóór de thread gestart is
-                    conn3 = get_db()
-                    conn3.execute(
-                        "UPDATE queue SET status='processing' WHERE id=? AND status='pending'",
-                        (job["id"],)
-                    )
-                    conn3.commit()
-                    conn3.close()
-                    logger.info(f"Dispatcher: start conversie {job['id'][:8]}")
-                    t = threading.Thread(
-                        target=run_job_thread,
-                        args=(job["id"],),
-                        name=f"Conversie-{job['id'][:8]}",
-                        daemon=True
-                    )
-                    t.start()
-                else:
-                    # Alle slots bezet — wacht tot er een vrijkomt
-                    time.sleep(1)
-            else:
-                # Geen werk — rustig wachten
-                time.sleep(3)
+            # Eerst een slot bemachtigen (non-blocking), pas daarna een job claimen
+            sem = _job_semaphore
+            if not sem.acquire(blocking=False):
+                # Alle slots bezet — wacht tot er een vrijkomt
+                wait_for_queue(timeout=5)
+                continue
+            try:
+                job = claim_next_job()
+            except Exception:
+                sem.release()
+                raise
+            if not job:
+                sem.release()
+                # Geen werk — slapen tot een producent ons wekt
+                wait_for_queue(timeout=30)
+                continue
+            logger.info(f"Dispatcher: start conversie {job['id'][-8:]}")
+            t = threading.Thread(
+                target=run_job_thread,
+                args=(job,),
+                name=f"Conversie-{job['id'][-8:]}",
+                daemon=True
+            )
+            t.start()
         except Exception as e:
             logger.error(f"Dispatcher fout: {e}")
             time.sleep(5)
@@ -1736,6 +2542,7 @@ def start_workers():
     # Stop eventuele oude dispatcher
     _dispatcher_running = False
     worker_running = False
+    notify_queue()  # wek een wachtende dispatcher zodat hij kan stoppen
     for t in worker_threads:
         t.join(timeout=2)
     worker_threads = []
@@ -1751,6 +2558,46 @@ def start_workers():
     worker_threads = [t]
     logger.info(f"Dispatcher actief (max {get_max_workers()} gelijktijdige conversie(s))")
 
+# ── Gebundelde herstarts ──────────────────────────────────────────────────────
+# API-wijzigingen (bibliotheken, instellingen) vragen een herstart aan i.p.v.
+# zelf een thread te starten. Eén achtergrondthread wacht RESTART_DEBOUNCE na
+# het eerste verzoek en voert daarna elke gevraagde herstart precies één keer
+# uit — snelle reeksen wijzigingen in de UI leveren zo één herstart op.
+RESTART_DEBOUNCE = 0.2
+
+_restart_requested = set()   # "watchers" en/of "semaphore"
+_restart_cv = threading.Condition()
+_restart_thread = None
+
+def request_restart(*what: str):
+    global _restart_thread
+    with _restart_cv:
+        _restart_requested.update(what)
+        if _restart_thread is None or not _restart_thread.is_alive():
+            _restart_thread = threading.Thread(target=_restart_loop, name="Restart", daemon=True)
+            _restart_thread.start()
+        _restart_cv.notify()
+
+def _restart_loop():
+    while True:
+        with _restart_cv:
+            while not _restart_requested:
+                _restart_cv.wait()
+        time.sleep(RESTART_DEBOUNCE)  # verzoeken binnen dit venster bundelen
+        with _restart_cv:
+            todo = set(_restart_requested)
+            _restart_requested.clear()
+        if "semaphore" in todo:
+            try:
+                update_semaphore()
+            except Exception as e:
+                logger.error(f"Herstart semaphore mislukt: {e}")
+        if "watchers" in todo:
+            try:
+                start_watchers()
+            except Exception as e:
+                logger.error(f"Herstart watchers mislukt: {e}")
+
 
 def watcher_monitor():
     """Herstart observers die gestopt zijn (bijv. na een fout)."""
@@ -1760,7 +2607,7 @@ def watcher_monitor():
             dead = [obs for obs in _observers if not obs.is_alive()]
             if dead:
                 logger.warning(f"Watcher monitor: {len(dead)} observer(s) gestopt — herstart...")
-                start_watchers()
+                request_restart("watchers")
         except Exception as e:
             logger.error(f"Watcher monitor fout: {e}")
 
@@ -1786,7 +2633,7 @@ def scan_existing_subtitles():
         for root, dirs, files in os.walk(path):
             dirs[:] = [d for d in dirs if not d.startswith(".")]
             for fname in files:
-                if Path(fname).suffix.lower() not in VIDEO_EXTENSIONS:
+                if not (fname.endswith(_VIDEO_SUFFIX_TUPLE) or fname.lower().endswith(_VIDEO_SUFFIX_TUPLE)):
                     continue
                 if fname.startswith("shryncing-"):
                     continue
@@ -1853,6 +2700,7 @@ def initial_startup():
         ).start()
     start_watchers()
     threading.Thread(target=watcher_monitor, daemon=True).start()
+    threading.Thread(target=db_maintenance_loop, name="DbOnderhoud", daemon=True).start()
     logger.info("Live monitoring actief.")
     # Ondertitel opstartscan in aparte thread
     threading.Thread(target=scan_existing_subtitles, daemon=True).start()
@@ -1908,63 +2756,50 @@ def api_recent():
 def api_savings():
     conn = get_db()
 
-    # Haal alle succesvolle history items op — zelfde bron als geschiedenis pagina
-    rows = conn.execute(
-        "SELECT h.*, l.name as library_name FROM history h "
-        "LEFT JOIN libraries l ON h.library_id = l.id "
-        "WHERE h.status = 'success'"
-    ).fetchall()
-
-    conn.close()
+    # Aggregatie in SQLite — alleen totalen, per bibliotheek en per dag
+    # komen naar Python, niet de volledige history tabel
+    total_files, total_original, total_new = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(original_size),0), COALESCE(SUM(new_size),0) "
+        "FROM history WHERE status='success'"
+    ).fetchone()
 
-    if not rows:
+    if not total_files:
+        conn.close()
         return {"totals": {}, "per_library": [], "daily": []}
 
-    # Bereken totalen in Python — betrouwbaarder dan SQL aggregates op lege sets
-    total_files    = len(rows)
-    total_original = sum(r["original_size"] or 0 for r in rows)
-    total_new      = sum(r["new_size"] or 0 for r in rows)
-    total_saved    = total_original - total_new
-
     totals = {
         "total_files":    total_files,
         "total_original": total_original,
         "total_new":      total_new,
-        "total_saved":    total_saved,
+        "total_saved":    total_original - total_new,
     }
 
     # Per bibliotheek
-    libs_map = {}
-    for r in rows:
-        key = r["library_id"] or "onbekend"
-        if key not in libs_map:
-            libs_map[key] = {
-                "library_name": r["library_name"] or "Onbekend",
-                "files": 0,
-                "original": 0,
-                "new_size": 0,
-                "saved": 0,
-            }
-        libs_map[key]["files"]    += 1
-        libs_map[key]["original"] += r["original_size"] or 0
-        libs_map[key]["new_size"] += r["new_size"] or 0
-        libs_map[key]["saved"]    += (r["original_size"] or 0) - (r["new_size"] or 0)
-
-    per_library = sorted(libs_map.values(), key=lambda x: x["saved"], reverse=True)
+    lib_rows = conn.execute(
+        "SELECT l.name AS library_name, COUNT(*) AS files, "
+        "COALESCE(SUM(h.original_size),0) AS original, COALESCE(SUM(h.new_size),0) AS new_size "
+        "FROM history h LEFT JOIN libraries l ON l.id = h.library_id "
+        "WHERE h.status='success' GROUP BY h.library_id "
+        "ORDER BY COALESCE(SUM(h.original_size),0) - COALESCE(SUM(h.new_size),0) DESC"
+    ).fetchall()
+    per_library = [{
+        "library_name": r["library_name"] or "Onbekend",
+        "files":        r["files"],
+        "original":     r["original"],
+        "new_size":     r["new_size"],
+        "saved":        r["original"] - r["new_size"],
+    } for r in lib_rows]
 
     # Per dag (laatste 30 dagen)
-    daily_map = {}
-    for r in rows:
-        if not r["finished_at"]:
-            continue
-        day = r["finished_at"][:10]  # YYYY-MM-DD
-        if day not in daily_map:
-            daily_map[day] = {"day": day, "files": 0, "saved": 0}
-        daily_map[day]["files"] += 1
-        daily_map[day]["saved"] += (r["original_size"] or 0) - (r["new_size"] or 0)
-
-    daily = sorted(daily_map.values(), key=lambda x: x["day"])
+    daily_rows = conn.execute(
+        "SELECT substr(finished_at,1,10) AS day, COUNT(*) AS files, "
+        "COALESCE(SUM(original_size - new_size),0) AS saved "
+        "FROM history WHERE status='success' AND finished_at >= date('now','-30 days') "
+        "GROUP BY day ORDER BY day"
+    ).fetchall()
+    daily = [dict(r) for r in daily_rows]
 
+    conn.close()
     return {"totals": totals, "per_library": per_library, "daily": daily}
 
 @app.get("/api/libraries")
@@ -1975,39 +2810,33 @@ def api_get_libraries():
     return [dict(l) for l in libs]
 
 @app.post("/api/libraries")
-def api_create_library(lib: LibraryCreate):
+def api_create_library(lib: LibraryCreate, conn: sqlite3.Connection = Depends(db_writer)):
     lid = str(uuid.uuid4())
-    conn = get_db()
     conn.execute(
         "INSERT INTO libraries (id,name,path,exclude_patterns,subtitle_quality) VALUES (?,?,?,?,?)",
         (lid, lib.name, lib.path,
          lib.exclude_patterns or "", lib.subtitle_quality or "normal")
     )
     conn.commit()
-    conn.close()
     threading.Thread(target=scan_library, args=(lid,), daemon=True).start()
-    threading.Thread(target=start_watchers, daemon=True).start()
+    request_restart("watchers")
     return {"id": lid}
 
 @app.put("/api/libraries/{lid}")
-def api_update_library(lid: str, lib: LibraryUpdate):
-    conn = get_db()
+def api_update_library(lid: str, lib: LibraryUpdate, conn: sqlite3.Connection = Depends(db_writer)):
     conn.execute(
         "UPDATE libraries SET name=?,path=?,enabled=?,exclude_patterns=?,subtitle_quality=? WHERE id=?",
         (lib.name, lib.path, 1 if lib.enabled else 0,
          lib.exclude_patterns or "", lib.subtitle_quality or "normal", lid)
     )
     conn.commit()
-    conn.close()
-    threading.Thread(target=start_watchers, daemon=True).start()
+    request_restart("watchers")
     return {"ok": True}
 
 @app.delete("/api/libraries/{lid}")
-def api_delete_library(lid: str):
-    conn = get_db()
+def api_delete_library(lid: str, conn: sqlite3.Connection = Depends(db_writer)):
     conn.execute("DELETE FROM libraries WHERE id=?", (lid,))
     conn.commit()
-    conn.close()
     return {"ok": True}
 
 @app.post("/api/libraries/{lid}/scan")
@@ -2017,11 +2846,12 @@ def api_scan_library(lid: str):
 
 @app.get("/api/libraries/{lid}/scan-status")
 def api_scan_status_single(lid: str):
-    return scan_status.get(lid, {"status": "idle"})
+    st = scan_status.get(lid)
+    return dict(st) if st is not None else {"status": "idle"}
 
 @app.get("/api/scan-status")
-def api_all_scan_status():
-    return scan_status
+async def api_all_scan_status():
+    return {lid: dict(st) for lid, st in scan_status.items()}
 
 @app.get("/api/libraries/{lid}/skipped")
 def api_skipped_files(lid: str):
@@ -2098,74 +2928,88 @@ def api_savings_chart():
         "files":     [r["files"] for r in rows],
     }
 
-@app.get("/api/queue")
-def api_queue(status: Optional[str] = None):
-    conn = get_db()
+# Velden van /api/queue en /api/history, in SELECT-volgorde
+QUEUE_FIELDS = ("id", "library_id", "file_path", "file_size", "status", "progress", "fps", "eta",
+                "added_at", "started_at", "finished_at", "error_msg", "original_size", "new_size",
+                "profile_id", "library_name")
+HISTORY_FIELDS = ("id", "library_id", "file_path", "original_size", "new_size", "duration_seconds",
+                  "status", "error_msg", "finished_at", "library_name")
+_QUEUE_SELECT = ("SELECT " + ", ".join(f"q.{f}" for f in QUEUE_FIELDS[:-1]) +
+                 ", l.name AS library_name FROM queue q LEFT JOIN libraries l ON q.library_id=l.id ")
+_HISTORY_SELECT = ("SELECT " + ", ".join(f"h.{f}" for f in HISTORY_FIELDS[:-1]) +
+                   ", l.name AS library_name FROM history h LEFT JOIN libraries l ON h.library_id=l.id ")
+
+def _queue_rows(conn, status: Optional[str]) -> list:
     if status:
-        rows = conn.execute(
-            "SELECT q.*, l.name as library_name FROM queue q LEFT JOIN libraries l ON q.library_id=l.id "
-            "WHERE q.status=? ORDER BY q.added_at DESC LIMIT 100", (status,)
-        ).fetchall()
-    else:
-        rows = conn.execute(
-            "SELECT q.*, l.name as library_name FROM queue q LEFT JOIN libraries l ON q.library_id=l.id "
-            "WHERE q.status IN ('pending','processing','error') ORDER BY q.status DESC, q.added_at ASC LIMIT 200"
-        ).fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+        return rows_as_dicts(conn, QUEUE_FIELDS,
+            _QUEUE_SELECT + "WHERE q.status=? ORDER BY q.added_at DESC, q.id DESC LIMIT 100", (status,))
+    return rows_as_dicts(conn, QUEUE_FIELDS,
+        _QUEUE_SELECT + "WHERE q.status IN ('pending','processing','error') "
+                        "ORDER BY q.status DESC, q.added_at ASC, q.id ASC LIMIT 200")
+
+@app.get("/api/queue")
+async def api_queue(status: Optional[str] = None):
+    return await run_db_read(_queue_rows, status)
 
 @app.delete("/api/queue/{jid}")
-def api_remove_queue(jid: str):
-    conn = get_db()
+def api_remove_queue(jid: str, conn: sqlite3.Connection = Depends(db_writer)):
     job = conn.execute("SELECT * FROM queue WHERE id=?", (jid,)).fetchone()
     if job and job["status"] == "processing":
         with active_jobs_lock:
-            for slot in active_jobs.values():
-                if slot["id"] == jid and slot["process"]:
-                    slot["process"].kill()
+            slot = jid_to_slot.get(jid)
+        if slot and slot["process"]:
+            slot["process"].kill()
     conn.execute("DELETE FROM queue WHERE id=?", (jid,))
     conn.commit()
-    conn.close()
     return {"ok": True}
 
 @app.post("/api/queue/add")
-def api_add_to_queue(data: dict):
+def api_add_to_queue(data: dict, conn: sqlite3.Connection = Depends(db_writer)):
     file_path = data.get("file_path", "")
     library_id = data.get("library_id")
-    if not file_path or not os.path.exists(file_path):
+    # Eén stat voor bestaan, type en grootte
+    try:
+        st = os.stat(file_path) if file_path else None
+    except (OSError, ValueError):  # ValueError: NUL-byte in het pad
+        st = None
+    if st is None:
         raise HTTPException(400, "Bestand niet gevonden")
-    conn = get_db()
-    existing = conn.execute(
-        "SELECT id FROM queue WHERE file_path=? AND status IN ('pending','processing')", (file_path,)
-    ).fetchone()
-    if existing:
-        conn.close()
+    if not stat.S_ISREG(st.st_mode):
+        raise HTTPException(400, "Geen bestand")
+    # Controle en insert in één statement: geen race tussen gelijktijdige aanroepen
+    jid = uuid7()
+    cur = conn.execute(
+        "INSERT INTO queue (id,library_id,file_path,file_size) SELECT ?,?,?,? "
+        "WHERE NOT EXISTS (SELECT 1 FROM queue WHERE file_path=? AND status IN ('pending','processing'))",
+        (jid, library_id, file_path, st.st_size, file_path)
+    )
+    if cur.rowcount == 0:
         raise HTTPException(400, "Al in wachtrij")
-    jid = str(uuid.uuid4())
-    fsize = os.path.getsize(file_path)
-    conn.execute("INSERT INTO queue (id,library_id,file_path,file_size) VALUES (?,?,?,?)",
-                 (jid, library_id, file_path, fsize))
     conn.commit()
-    conn.close()
+    notify_queue()
     return {"id": jid}
 
-@app.get("/api/settings")
-def api_get_settings():
-    conn = get_db()
+def _settings_rows(conn) -> dict:
     rows = conn.execute("SELECT key, value FROM settings").fetchall()
-    conn.close()
     return {r["key"]: r["value"] for r in rows}
 
+@app.get("/api/settings")
+async def api_get_settings():
+    return await run_db_read(_settings_rows)
+
 @app.post("/api/settings")
-def api_save_settings(data: dict):
-    conn = get_db()
-    for key, value in data.items():
-        conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?,?)", (key, str(value)))
-    conn.commit()
-    conn.close()
+def api_save_settings(data: dict, conn: sqlite3.Connection = Depends(db_writer)):
+    # Eén transactie voor alle sleutels (with conn: commit of rollback)
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?,?)",
+                         [(key, str(value)) for key, value in data.items()])
+    invalidate_settings_cache()
     if "max_workers" in data:
         # Semaphore bijwerken — loopt direct door zonder workers te herstarten
-        threading.Thread(target=update_semaphore, daemon=True).start()
+        request_restart("semaphore")
+    if "watch_interval" in data:
+        # Polling watchers opnieuw starten met het nieuwe interval
+        request_restart("watchers")
     return {"ok": True}
 
 @app.post("/api/workers/pause")
@@ -2188,6 +3032,7 @@ def api_pause_workers():
 def api_resume_workers():
     global workers_paused
     workers_paused = False
+    notify_queue()
     # Stuur SIGCONT naar alle gepauzeerde ffmpeg-processen
     import signal
     with active_jobs_lock:
@@ -2206,57 +3051,80 @@ def api_workers_status():
         active = len(active_jobs)
     return {"paused": workers_paused, "active": active, "running": worker_running}
 
-@app.get("/api/diagnostics")
-def api_diagnostics():
-    """Toont wat de container ziet — handig voor probleemoplossing."""
-    conn = get_db()
-    libs = conn.execute("SELECT * FROM libraries").fetchall()
-    conn.close()
+DIAG_VIDEO_CAP      = 10_000  # tellen stopt hier — een ordegrootte is genoeg
+DIAG_WALK_TIMEOUT   = 15.0    # seconden per bibliotheek (trage/vastgelopen NFS)
 
-    results = []
-    for lib in libs:
-        path = lib["path"]
-        info = {"id": lib["id"], "name": lib["name"], "path": path}
+def _diagnose_library(lib) -> dict:
+    """Diagnose van één bibliotheek: bestaat het pad, wat staat erin, hoeveel video's."""
+    path = lib["path"]
+    info = {"id": lib["id"], "name": lib["name"], "path": path}
 
-        if not os.path.exists(path):
-            info["error"] = f"Pad bestaat NIET in container: {path}"
-            info["files"] = []
-            results.append(info)
-            continue
+    if not os.path.exists(path):
+        info["error"] = f"Pad bestaat NIET in container: {path}"
+        info["files"] = []
+        return info
 
-        if not os.path.isdir(path):
-            info["error"] = f"Pad is geen map: {path}"
-            info["files"] = []
-            results.append(info)
-            continue
+    if not os.path.isdir(path):
+        info["error"] = f"Pad is geen map: {path}"
+        info["files"] = []
+        return info
 
-        # List top-level contents
-        try:
-            top = os.listdir(path)
-            info["top_level_count"] = len(top)
-            info["top_level_sample"] = top[:20]
-        except Exception as e:
-            info["error"] = f"Kan map niet lezen: {e}"
-            results.append(info)
-            continue
+    # List top-level contents — eerste 20 namen als voorbeeld, de rest alleen
+    # tellen (geen volledige lijst van namen opbouwen)
+    try:
+        with os.scandir(path) as it:
+            sample = [e.name for e in itertools.islice(it, 20)]
+            info["top_level_count"] = len(sample) + sum(1 for _ in it)
+        info["top_level_sample"] = sample
+    except Exception as e:
+        info["error"] = f"Kan map niet lezen: {e}"
+        return info
 
-        # Count video files recursively
-        video_count = 0
-        video_sample = []
-        try:
-            for root, dirs, files in os.walk(path):
-                dirs[:] = [d for d in dirs if not d.startswith('.')]
-                for fname in files:
-                    if Path(fname).suffix.lower() in VIDEO_EXTENSIONS:
-                        video_count += 1
-                        if len(video_sample) < 5:
-                            video_sample.append(os.path.join(root, fname))
-        except Exception as e:
-            info["walk_error"] = str(e)
+    # Count video files recursively — begrensd in aantal en tijd
+    video_count = 0
+    video_sample = []
+    truncated = False
+    try:
+        for entry in _iter_video_entries(path, deadline=time.monotonic() + DIAG_WALK_TIMEOUT):
+            video_count += 1
+            if len(video_sample) < 5:
+                video_sample.append(entry.path)
+            if video_count >= DIAG_VIDEO_CAP:
+                truncated = True
+                break
+    except TimeoutError as e:
+        truncated = True
+        info["walk_error"] = str(e)
+    except Exception as e:
+        info["walk_error"] = str(e)
+
+    info["video_files_found"] = video_count
+    info["video_files_truncated"] = truncated
+    info["video_sample"] = video_sample
+    return info
 
-        info["video_files_found"] = video_count
-        info["video_sample"] = video_sample
-        results.append(info)
+@app.get("/api/diagnostics")
+def api_diagnostics():
+    """Toont wat de container ziet — handig voor probleemoplossing."""
+    # Verbinding direct teruggeven: de walk hieronder kan lang duren
+    with get_db() as conn:
+        libs = conn.execute("SELECT * FROM libraries").fetchall()
+
+    # Bibliotheken staan vaak op verschillende schijven/shares: doorloop ze
+    # parallel zodat de wachttijd niet optelt. Volgorde blijft die van de db.
+    results = [None] * len(libs)
+    if libs:
+        with ThreadPoolExecutor(max_workers=min(8, len(libs)),
+                                thread_name_prefix="Diagnose") as pool:
+            futures = {pool.submit(_diagnose_library, lib): i for i, lib in enumerate(libs)}
+            for fut in as_completed(futures):
+                i = futures[fut]
+                try:
+                    results[i] = fut.result()
+                except Exception as e:
+                    lib = libs[i]
+                    results[i] = {"id": lib["id"], "name": lib["name"], "path": lib["path"],
+                                  "error": str(e)}
 
     # Also show /media contents
     media_root = {}
@@ -2270,15 +3138,21 @@ def api_diagnostics():
 
     return {"libraries": results, "media_root": media_root}
 
+# /api/config en /api/profiles veranderen niet binnen de levensduur van de
+# container: de JSON wordt één keer opgebouwd en de browser mag hem cachen.
+_STATIC_JSON_HEADERS = {"Cache-Control": "public, max-age=60"}
+
+_gpu_mode = os.environ.get("GPU_MODE", "cpu").lower()
+_CONFIG_JSON = orjson.dumps({
+    "gpu_available": _gpu_mode in ("nvidia", "amd", "intel"),
+    "gpu_mode":      _gpu_mode,
+    "version":       SHRYNC_VERSION,
+})
+
 @app.get("/api/config")
 def api_config():
     """Geeft runtime configuratie terug zodat de UI weet welke functies beschikbaar zijn."""
-    gpu_mode = os.environ.get("GPU_MODE", "cpu").lower()
-    return {
-        "gpu_available": gpu_mode in ("nvidia", "amd", "intel"),
-        "gpu_mode":      gpu_mode,
-        "version":       SHRYNC_VERSION,
-    }
+    return Response(_CONFIG_JSON, media_type="application/json", headers=_STATIC_JSON_HEADERS)
 
 
 @app.get("/api/gpu-monitor")
@@ -2362,107 +3236,146 @@ def api_gpu_monitor():
     return result
 
 
+# Alle beschikbare encoder profielen met encoder_type label — onveranderlijk,
+# één keer bij import opgebouwd
+_PROFILES = (
+    # ── Nvidia NVENC ──────────────────────────────────────────────────────
+    {"id": "nvenc_max",      "label": "NVENC H.265 — Max kwaliteit",    "codec": "hevc_nvenc", "encoder": "nvidia"},
+    {"id": "nvenc_high",     "label": "NVENC H.265 — Hoge kwaliteit",   "codec": "hevc_nvenc", "encoder": "nvidia"},
+    {"id": "nvenc_balanced", "label": "NVENC H.265 — Gebalanceerd",     "codec": "hevc_nvenc", "encoder": "nvidia"},
+    {"id": "h264_nvenc",     "label": "NVENC H.264 — Hoge kwaliteit",   "codec": "h264_nvenc", "encoder": "nvidia"},
+    # ── AMD AMF ───────────────────────────────────────────────────────────
+    {"id": "amf_max",        "label": "AMF H.265 — Max kwaliteit",      "codec": "hevc_amf",   "encoder": "amd"},
+    {"id": "amf_balanced",   "label": "AMF H.265 — Gebalanceerd",       "codec": "hevc_amf",   "encoder": "amd"},
+    {"id": "h264_amf",       "label": "AMF H.264 — Hoge kwaliteit",     "codec": "h264_amf",   "encoder": "amd"},
+    # ── Intel QSV ─────────────────────────────────────────────────────────
+    {"id": "qsv_max",        "label": "QSV H.265 — Max kwaliteit",      "codec": "hevc_qsv",   "encoder": "intel"},
+    {"id": "qsv_balanced",   "label": "QSV H.265 — Gebalanceerd",       "codec": "hevc_qsv",   "encoder": "intel"},
+    {"id": "h264_qsv",       "label": "QSV H.264 — Hoge kwaliteit",     "codec": "h264_qsv",   "encoder": "intel"},
+    # ── CPU ───────────────────────────────────────────────────────────────
+    {"id": "cpu_slow",       "label": "CPU H.265 — Max kwaliteit",      "codec": "libx265",    "encoder": "cpu"},
+    {"id": "cpu_medium",     "label": "CPU H.265 — Gebalanceerd",       "codec": "libx265",    "encoder": "cpu"},
+    {"id": "cpu_fast",       "label": "CPU H.265 — Snel",               "codec": "libx265",    "encoder": "cpu"},
+    {"id": "h264_cpu",       "label": "CPU H.264 — Gebalanceerd",       "codec": "libx264",    "encoder": "cpu"},
+)
+_PROFILES_JSON = orjson.dumps(_PROFILES)
+
 @app.get("/api/profiles")
 def api_get_profiles():
     """Geeft alle beschikbare encoder profielen terug met encoder_type label."""
-    return [
-        # ── Nvidia NVENC ──────────────────────────────────────────────────────
-        {"id": "nvenc_max",      "label": "NVENC H.265 — Max kwaliteit",    "codec": "hevc_nvenc", "encoder": "nvidia"},
-        {"id": "nvenc_high",     "label": "NVENC H.265 — Hoge kwaliteit",   "codec": "hevc_nvenc", "encoder": "nvidia"},
-        {"id": "nvenc_balanced", "label": "NVENC H.265 — Gebalanceerd",     "codec": "hevc_nvenc", "encoder": "nvidia"},
-        {"id": "h264_nvenc",     "label": "NVENC H.264 — Hoge kwaliteit",   "codec": "h264_nvenc", "encoder": "nvidia"},
-        # ── AMD AMF ───────────────────────────────────────────────────────────
-        {"id": "amf_max",        "label": "AMF H.265 — Max kwaliteit",      "codec": "hevc_amf",   "encoder": "amd"},
-        {"id": "amf_balanced",   "label": "AMF H.265 — Gebalanceerd",       "codec": "hevc_amf",   "encoder": "amd"},
-        {"id": "h264_amf",       "label": "AMF H.264 — Hoge kwaliteit",     "codec": "h264_amf",   "encoder": "amd"},
-        # ── Intel QSV ─────────────────────────────────────────────────────────
-        {"id": "qsv_max",        "label": "QSV H.265 — Max kwaliteit",      "codec": "hevc_qsv",   "encoder": "intel"},
-        {"id": "qsv_balanced",   "label": "QSV H.265 — Gebalanceerd",       "codec": "hevc_qsv",   "encoder": "intel"},
-        {"id": "h264_qsv",       "label": "QSV H.264 — Hoge kwaliteit",     "codec": "h264_qsv",   "encoder": "intel"},
-        # ── CPU ───────────────────────────────────────────────────────────────
-        {"id": "cpu_slow",       "label": "CPU H.265 — Max kwaliteit",      "codec": "libx265",    "encoder": "cpu"},
-        {"id": "cpu_medium",     "label": "CPU H.265 — Gebalanceerd",       "codec": "libx265",    "encoder": "cpu"},
-        {"id": "cpu_fast",       "label": "CPU H.265 — Snel",               "codec": "libx265",    "encoder": "cpu"},
-        {"id": "h264_cpu",       "label": "CPU H.264 — Gebalanceerd",       "codec": "libx264",    "encoder": "cpu"},
-    ]
+    return Response(_PROFILES_JSON, media_type="application/json", headers=_STATIC_JSON_HEADERS)
 
-@app.get("/api/history")
-def api_history(page: int = 1, per_page: int = 50, search: str = "",
-                sort: str = "finished_at", dir: str = "desc"):
+HISTORY_STREAM_CHUNK = 200  # rijen per geschreven blok
+
+def _history_json_block(rows: list, first: bool) -> bytes:
+    block = b",".join(orjson.dumps(dict(zip(HISTORY_FIELDS, r))) for r in rows)
+    return block if first else b"," + block
+
+def _history_open(conn, page: int, per_page: int, search: str, sort: str, dir: str):
+    """
+    Voert de telling en de pagina-query uit en leest het eerste blok rijen.
+    Geeft (kop + eerste blok als JSON, cursor of None als alles al gelezen is).
+    """
     offset = (page - 1) * per_page
     # Toegestane sorteerkolommen (SQL injection preventie)
     allowed_sort = {"file_path","library_name","finished_at","status"}
     sort_col = sort if sort in allowed_sort else "finished_at"
     sort_dir = "DESC" if dir.lower() == "desc" else "ASC"
-    conn = get_db()
     if search:
         like = f"%{search}%"
         total = conn.execute(
             "SELECT COUNT(*) as c FROM history h LEFT JOIN libraries l ON h.library_id=l.id "
             "WHERE h.file_path LIKE ? OR l.name LIKE ?", (like, like)
         ).fetchone()["c"]
-        rows = conn.execute(
-            f"SELECT h.*, l.name as library_name FROM history h LEFT JOIN libraries l ON h.library_id=l.id "
-            f"WHERE h.file_path LIKE ? OR l.name LIKE ? "
-            f"ORDER BY {sort_col} {sort_dir} LIMIT ? OFFSET ?",
-            (like, like, per_page, offset)
-        ).fetchall()
+        sql = (_HISTORY_SELECT + f"WHERE h.file_path LIKE ? OR l.name LIKE ? "
+                                 f"ORDER BY {sort_col} {sort_dir} LIMIT ? OFFSET ?")
+        params = (like, like, per_page, offset)
     else:
-        total = conn.execute("SELECT COUNT(*) as c FROM history").fetchone()["c"]
-        rows = conn.execute(
-            f"SELECT h.*, l.name as library_name FROM history h LEFT JOIN libraries l ON h.library_id=l.id "
-            f"ORDER BY {sort_col} {sort_dir} LIMIT ? OFFSET ?", (per_page, offset)
-        ).fetchall()
-    conn.close()
-    return {"total": total, "page": page, "items": [dict(r) for r in rows]}
+        total = conn.execute("SELECT v FROM meta WHERE k='history_count'").fetchone()["v"]
+        sql = _HISTORY_SELECT + f"ORDER BY {sort_col} {sort_dir} LIMIT ? OFFSET ?"
+        params = (per_page, offset)
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute(sql, params)
+    rows = cur.fetchmany(HISTORY_STREAM_CHUNK)
+    head = b'{"total":%d,"page":%d,"items":[' % (total, page) + _history_json_block(rows, True)
+    if len(rows) < HISTORY_STREAM_CHUNK:
+        cur.close()
+        return head, None
+    return head, cur
 
-@app.delete("/api/history/{hid}")
-def api_delete_history_item(hid: str):
+@app.get("/api/history")
+async def api_history(page: int = 1, per_page: int = 50, search: str = "",
+                      sort: str = "finished_at", dir: str = "desc"):
+    """
+    Streamt de geschiedenispagina: hooguit HISTORY_STREAM_CHUNK rijen tegelijk
+    in het geheugen, ongeacht per_page. Telling en eerste blok worden gelezen
+    vóór het antwoord begint, zodat een databasefout nog een 500 wordt; alle
+    reads lopen via de begrensde leesgroep (_db_read_limiter).
+    """
     conn = get_db()
+    try:
+        head, cur = await anyio.to_thread.run_sync(
+            _history_open, conn, page, per_page, search, sort, dir,
+            limiter=_db_read_limiter)
+    except BaseException:
+        conn.close()
+        raise
+    if cur is None:
+        conn.close()
+        return Response(head + b"]}", media_type="application/json")
+
+    async def body():
+        try:
+            yield head
+            while rows := await anyio.to_thread.run_sync(
+                    cur.fetchmany, HISTORY_STREAM_CHUNK, limiter=_db_read_limiter):
+                yield _history_json_block(rows, False)
+            yield b"]}"
+        finally:
+            cur.close()  # lopend statement resetten vóór de verbinding terug gaat
+            conn.close()
+
+    return StreamingResponse(body(), media_type="application/json")
+
+@app.delete("/api/history/{hid}")
+def api_delete_history_item(hid: str, conn: sqlite3.Connection = Depends(db_writer)):
     conn.execute("DELETE FROM history WHERE id=?", (hid,))
     conn.commit()
-    conn.close()
     return {"ok": True}
 
 
 @app.post("/api/history/{hid}/retry")
-def api_retry_history(hid: str):
+def api_retry_history(hid: str, conn: sqlite3.Connection = Depends(db_writer)):
     """Zet een mislukte conversie opnieuw in de wachtrij."""
-    conn = get_db()
     item = conn.execute("SELECT * FROM history WHERE id=? AND status='error'", (hid,)).fetchone()
     if not item:
-        conn.close()
         raise HTTPException(404, "Niet gevonden of niet mislukt")
     file_path = item["file_path"]
     if not os.path.exists(file_path):
-        conn.close()
         raise HTTPException(400, "Bronbestand bestaat niet meer")
-    # Controleer of al in wachtrij
-    existing = conn.execute(
-        "SELECT id FROM queue WHERE file_path=? AND status IN ('pending','processing')", (file_path,)
-    ).fetchone()
-    if existing:
-        conn.close()
+    # Toevoegen aan wachtrij, tenzij het pad er al in staat (controle en insert
+    # in één statement, zodat een gelijktijdige scan of watcher niet tussendoor kan)
+    jid = uuid7()
+    fsize = os.path.getsize(file_path)
+    inserted = conn.execute(
+        "INSERT INTO queue (id,library_id,file_path,file_size,status) "
+        "SELECT ?,?,?,?,'pending' WHERE NOT EXISTS "
+        "(SELECT 1 FROM queue WHERE file_path=? AND status IN ('pending','processing'))",
+        (jid, item["library_id"], file_path, fsize, file_path)
+    ).rowcount
+    if not inserted:
         raise HTTPException(400, "Al in wachtrij")
     # Verwijder oude foutmelding uit geschiedenis
     conn.execute("DELETE FROM history WHERE id=?", (hid,))
-    # Toevoegen aan wachtrij
-    jid = str(uuid.uuid4())
-    fsize = os.path.getsize(file_path)
-    conn.execute(
-        "INSERT INTO queue (id,library_id,file_path,file_size,status) VALUES (?,?,?,?,'pending')",
-        (jid, item["library_id"], file_path, fsize)
-    )
     conn.commit()
-    conn.close()
+    notify_queue()
     return {"id": jid}
 
 @app.delete("/api/history")
-def api_clear_history():
-    conn = get_db()
+def api_clear_history(conn: sqlite3.Connection = Depends(db_writer)):
     conn.execute("DELETE FROM history")
     conn.commit()
-    conn.close()
     return {"ok": True}
 
 
@@ -2520,59 +3433,50 @@ def api_subtitle_history(page: int = 1, per_page: int = 50):
     return {"total": total, "page": page, "items": [dict(r) for r in rows]}
 
 @app.delete("/api/subtitle/queue/{jid}")
-def api_subtitle_queue_remove(jid: str):
-    conn = get_db()
+def api_subtitle_queue_remove(jid: str, conn: sqlite3.Connection = Depends(db_writer)):
     conn.execute("DELETE FROM subtitle_queue WHERE id=?", (jid,))
     conn.commit()
-    conn.close()
     return {"ok": True}
 
 @app.delete("/api/subtitle/queue")
-def api_subtitle_queue_clear():
+def api_subtitle_queue_clear(conn: sqlite3.Connection = Depends(db_writer)):
     """Verwijdert alle pending items uit de ondertitelwachtrij. Lopende jobs blijven."""
-    conn = get_db()
     deleted = conn.execute(
         "DELETE FROM subtitle_queue WHERE status='pending'"
     ).rowcount
     conn.commit()
-    conn.close()
     return {"ok": True, "deleted": deleted}
 
 @app.post("/api/subtitle/retry/{hid}")
 def api_subtitle_retry(hid: str):
-    conn = get_db()
-    item = conn.execute(
-        "SELECT * FROM subtitle_history WHERE id=? AND status='error'", (hid,)
-    ).fetchone()
+    with get_db() as conn:
+        item = conn.execute(
+            "SELECT * FROM subtitle_history WHERE id=? AND status='error'", (hid,)
+        ).fetchone()
     if not item:
-        conn.close()
         raise HTTPException(404, "Niet gevonden of niet mislukt")
     if not os.path.exists(item["file_path"]):
-        conn.close()
         raise HTTPException(400, "Bronbestand bestaat niet meer")
     streams = detect_subtitle_streams(item["file_path"])
     best = pick_best_english_stream(streams)
     if not best:
-        conn.close()
         raise HTTPException(400, "Geen Engelse ondertitelstream gevonden")
     jid = str(uuid.uuid4())
-    conn.execute("DELETE FROM subtitle_history WHERE id=?", (hid,))
-    conn.execute(
-        "INSERT INTO subtitle_queue (id,library_id,file_path,file_size,subtitle_track_index,status) "
-        "VALUES (?,?,?,?,?,'pending')",
-        (jid, item["library_id"], item["file_path"],
-         os.path.getsize(item["file_path"]), best["index"])
-    )
-    conn.commit()
-    conn.close()
+    with db_writer_session() as conn:
+        conn.execute("DELETE FROM subtitle_history WHERE id=?", (hid,))
+        conn.execute(
+            "INSERT INTO subtitle_queue (id,library_id,file_path,file_size,subtitle_track_index,status) "
+            "VALUES (?,?,?,?,?,'pending')",
+            (jid, item["library_id"], item["file_path"],
+             os.path.getsize(item["file_path"]), best["index"])
+        )
+        conn.commit()
     return {"id": jid}
 
 @app.delete("/api/subtitle/history")
-def api_subtitle_clear_history():
-    conn = get_db()
+def api_subtitle_clear_history(conn: sqlite3.Connection = Depends(db_writer)):
     conn.execute("DELETE FROM subtitle_history WHERE status='error'")
     conn.commit()
-    conn.close()
     return {"ok": True}
 
 class BulkHistoryAction(BaseModel):
@@ -2591,14 +3495,19 @@ def api_subtitle_history_bulk(body: BulkHistoryAction):
     if body.action not in ("delete_srt", "requeue"):
         raise HTTPException(400, "Ongeldige actie")
 
-    conn = get_db()
     results = {"ok": 0, "failed": 0, "errors": []}
 
     placeholders = ",".join("?" * len(body.ids))
-    items = conn.execute(
-        f"SELECT * FROM subtitle_history WHERE id IN ({placeholders})",
-        body.ids
-    ).fetchall()
+    with get_db() as conn:
+        items = conn.execute(
+            f"SELECT * FROM subtitle_history WHERE id IN ({placeholders})",
+            body.ids
+        ).fetchall()
+
+    # Eerst bestanden en streams controleren, daarna alles in één keer schrijven:
+    # de schrijfverbinding blijft zo niet bezet tijdens ffprobe.
+    deleted_ids = []
+    queued = []
 
     for item in items:
         try:
@@ -2609,7 +3518,7 @@ def api_subtitle_history_bulk(body: BulkHistoryAction):
                     os.remove(srt_path)
                     logger.info(f"SRT verwijderd: {srt_path}")
                 # Verwijder history record
-                conn.execute("DELETE FROM subtitle_history WHERE id=?", (item["id"],))
+                deleted_ids.append((item["id"],))
                 results["ok"] += 1
 
             elif body.action == "requeue":
@@ -2634,14 +3543,9 @@ def api_subtitle_history_bulk(body: BulkHistoryAction):
                     results["failed"] += 1
                     results["errors"].append(f"{Path(item['file_path']).name}: geen geschikte ondertitelstream gevonden")
                     continue
-                jid = str(uuid.uuid4())
-                conn.execute("DELETE FROM subtitle_history WHERE id=?", (item["id"],))
-                conn.execute(
-                    "INSERT INTO subtitle_queue (id,library_id,file_path,file_size,subtitle_track_index,status) "
-                    "VALUES (?,?,?,?,?,'pending')",
-                    (jid, item["library_id"], item["file_path"],
-                     os.path.getsize(item["file_path"]), best["index"])
-                )
+                deleted_ids.append((item["id"],))
+                queued.append((str(uuid.uuid4()), item["library_id"], item["file_path"],
+                               os.path.getsize(item["file_path"]), best["index"]))
                 results["ok"] += 1
 
         except Exception as e:
@@ -2649,8 +3553,14 @@ def api_subtitle_history_bulk(body: BulkHistoryAction):
             results["errors"].append(f"{Path(item['file_path']).name}: {str(e)[:100]}")
             logger.warning(f"Bulk subtitle actie fout voor {item['file_path']}: {e}")
 
-    conn.commit()
-    conn.close()
+    with db_writer_session() as conn:
+        conn.executemany("DELETE FROM subtitle_history WHERE id=?", deleted_ids)
+        conn.executemany(
+            "INSERT INTO subtitle_queue (id,library_id,file_path,file_size,subtitle_track_index,status) "
+            "VALUES (?,?,?,?,?,'pending')",
+            queued
+        )
+        conn.commit()
     return results
 
 @app.get("/api/subtitle/active")
@@ -2697,22 +3607,20 @@ def api_subtitle_add(data: dict):
     best = pick_best_english_stream(streams)
     if not best:
         raise HTTPException(400, "Geen Engelse ondertitelstream gevonden in dit bestand")
-    conn = get_db()
-    existing = conn.execute(
-        "SELECT id FROM subtitle_queue WHERE file_path=? AND status IN ('pending','processing')",
-        (file_path,)
-    ).fetchone()
-    if existing:
-        conn.close()
-        raise HTTPException(400, "Al in ondertitelwachtrij")
-    jid = str(uuid.uuid4())
-    conn.execute(
-        "INSERT INTO subtitle_queue (id,library_id,file_path,file_size,subtitle_track_index,status) "
-        "VALUES (?,?,?,?,?,'pending')",
-        (jid, library_id, file_path, os.path.getsize(file_path), best["index"])
-    )
-    conn.commit()
-    conn.close()
+    with db_writer_session() as conn:
+        existing = conn.execute(
+            "SELECT id FROM subtitle_queue WHERE file_path=? AND status IN ('pending','processing')",
+            (file_path,)
+        ).fetchone()
+        if existing:
+            raise HTTPException(400, "Al in ondertitelwachtrij")
+        jid = str(uuid.uuid4())
+        conn.execute(
+            "INSERT INTO subtitle_queue (id,library_id,file_path,file_size,subtitle_track_index,status) "
+            "VALUES (?,?,?,?,?,'pending')",
+            (jid, library_id, file_path, os.path.getsize(file_path), best["index"])
+        )
+        conn.commit()
     return {"id": jid}
 
 
@@ -2739,7 +3647,7 @@ def api_scan_subtitles_library(lid: str):
         for root, dirs, files in os.walk(path):
             dirs[:] = [d for d in dirs if not d.startswith(".")]
             for fname in files:
-                if Path(fname).suffix.lower() not in VIDEO_EXTENSIONS:
+                if not (fname.endswith(_VIDEO_SUFFIX_TUPLE) or fname.lower().endswith(_VIDEO_SUFFIX_TUPLE)):
                     continue
                 if fname.startswith("shryncing-"):
                     continue